@@ -12,3 +12,7 @@ __version__ = data["project"]["version"]
 from .process_ambience_data import AmBIENCeDataset
 from .process_ambience_data import ABMDataset
 from .process_ambience_definitions import ABMDefinitions
+from .structure_physics import calculate_effective_thermal_mass_array
+from .structure_physics import calculate_U_value_arrays
+from .spine_db import import_mapped_data
+from .manifest import read_manifest, write_manifest, update_package
@@ -0,0 +1,186 @@
+# aggregation.py
+
+# Weighted aggregation over factorized group codes, shared by the data and definitions.
+
+import numpy as np
+import pandas as pd
+
+# Combined group codes up to this size are numbered with a lookup table, see `factorize_groups`.
+DENSE_CODE_LIMIT = 2**20
+
+
+def factorize_groups(keys, sort=True, dropna=True):
+    """
+    Factorize rows into integer group codes by the values of the key columns.
+
+    The codes of each column are combined into a single integer code,
+    so that no frame of the keys or tuples of their values are built.
+
+    Parameters
+    ----------
+    keys : dict
+        the key columns as Series, arrays, or Categoricals of equal length, keyed by name.
+    sort : bool
+        Flag to number the groups in the sorted order of their keys, like `DataFrame.groupby`,
+        categoricals sorted by their categories. Otherwise, the groups are numbered in order of appearance.
+    dropna : bool
+        Flag to leave rows with missing keys out of the groups with code `-1`,
+        otherwise missing values form groups of their own.
+
+    Returns
+    -------
+    codes : array
+        the group code of each row.
+    index : Index
+        the keys of each group, a MultiIndex for several key columns.
+    """
+    columns = list(keys.values())
+    codes = np.zeros(len(columns[0]), dtype=np.int64)
+    valid = np.ones(len(codes), dtype=bool)
+    radix = 1
+    for col in columns:
+        if isinstance(col.dtype, pd.CategoricalDtype) and sort:
+            # Categoricals are already factorized, sorted by their categories.
+            col_codes = np.asarray(pd.Categorical(col).codes, dtype=np.int64)
+            num_uniques = len(col.dtype.categories)
+        else:
+            col_codes, col_uniques = pd.factorize(col, sort=sort)
+            num_uniques = len(col_uniques)
+        if dropna:
+            valid &= col_codes >= 0
+        if radix * (num_uniques + 1) >= 2**62:
+            # Compress the combined codes to avoid overflows.
+            codes = pd.factorize(codes, sort=sort)[0]
+            radix = codes.max(initial=0) + 1
+        # Missing values get code zero.
+        codes = codes * (num_uniques + 1) + col_codes + 1
+        radix *= num_uniques + 1
+    if sort and radix <= max(len(codes), DENSE_CODE_LIMIT):
+        # Number the observed codes in sorted order with a lookup table instead of sorting them.
+        observed = np.zeros(radix, dtype=bool)
+        observed[codes[valid]] = True
+        numbers = np.cumsum(observed) - 1
+        codes = np.where(valid, numbers[codes], -1)
+        num_groups = int(observed.sum())
+    else:
+        codes[valid], uniques = pd.factorize(codes[valid], sort=sort)
+        codes[~valid] = -1
+        num_groups = len(uniques)
+    # The keys of each group are taken from its first row.
+    first = pd.Series(codes[valid]).drop_duplicates()
+    first_rows = np.empty(num_groups, dtype=np.int64)
+    first_rows[first.to_numpy()] = np.flatnonzero(valid)[first.index]
+    values = [getattr(col, "array", col).take(first_rows) for col in columns]
+    if len(values) == 1:
+        return codes, pd.Index(values[0], name=list(keys)[0])
+    return codes, pd.MultiIndex.from_arrays(values, names=list(keys))
+
+
+def group_sums(codes, values, num_groups, compensated=True):
+    """
+    Sum the values of each group exactly like `DataFrame.groupby(...).sum()`.
+
+    The values of each group are summed in row order with Kahan compensation by the groupby kernel itself,
+    skipping missing values, so that the sums are identical to the chained groupby operations they replace.
+    Without compensation, the values are summed in row order with `numpy.bincount`,
+    like the builtin `sum` applied to each group, missing values included.
+
+    Parameters
+    ----------
+    codes : array
+        the group code of each row, rows with code `-1` are left out.
+    values : array
+        the values to sum, with the rows along the first axis.
+    num_groups : int
+        the number of groups.
+    compensated : bool
+        Flag to sum with Kahan compensation like `DataFrame.groupby(...).sum()`.
+
+    Returns
+    -------
+    sums : array
+        the sums with the groups along the first axis, followed by the remaining axes of the values.
+    """
+    values = np.asarray(values, dtype=float)
+    codes = np.asarray(codes)
+    columns = values.reshape(len(codes), -1)
+    included = codes >= 0
+    if not included.all():
+        codes, columns = codes[included], columns[included]
+    if compensated:
+        # The codes are passed as categories to skip factorizing them again.
+        groups = pd.Categorical.from_codes(codes, categories=pd.RangeIndex(num_groups))
+        sums = (
+            pd.DataFrame(columns)
+            .groupby(groups, observed=False, sort=True)
+            .sum()
+            .to_numpy()
+        )
+    else:
+        sums = np.column_stack(
+            [np.bincount(codes, weights=col, minlength=num_groups) for col in columns.T]
+        )
+    return sums.reshape((num_groups,) + values.shape[1:])
+
+
+def normalize_weights(keys, weights, compensated=True):
+    """
+    Normalize weights to sum up to one within each group, like dividing them by their `groupby(keys)` sums.
+
+    Parameters
+    ----------
+    keys : dict
+        the key columns to group by, see `factorize_groups`.
+    weights : array
+        the weight of each row.
+    compensated : bool
+        Flag to sum the weights of each group like `DataFrame.groupby(...).sum()`,
+        otherwise like the builtin `sum`, see `group_sums`.
+
+    Returns
+    -------
+    totals : array
+        the total weight of the group of each row, `NaN` for rows with missing keys.
+    normalized : array
+        the normalized weight of each row, `NaN` for rows with missing keys.
+    """
+    codes, index = factorize_groups(keys)
+    weights = np.asarray(weights, dtype=float)
+    totals = group_sums(codes, weights, len(index), compensated=compensated)
+    totals = np.where(codes >= 0, totals[codes], np.nan)
+    return totals, weights / totals
+
+
+def weighted_sums(keys, values, weights=None):
+    """
+    Aggregate weighted value columns over groups in one go, replacing groupby-sum-join-multiply-groupby-sum chains.
+
+    Equivalent to multiplying each value column by the weights and summing them with
+    `DataFrame.groupby(keys).sum()`, without building intermediate frames or joins.
+    For weighted means, the weights are normalized within each group first, see `normalize_weights`,
+    so that the products and their sums are calculated in the same order as the chained groupby operations.
+
+    Parameters
+    ----------
+    keys : dict
+        the key columns to group by, see `factorize_groups`.
+    values : dict
+        the value columns to aggregate as Series or arrays, keyed by name.
+    weights : array
+        the weight of each row, `None` if the values are already weighted.
+
+    Returns
+    -------
+    sums : DataFrame
+        the weighted sums of the value columns, indexed by the sorted group keys.
+    """
+    codes, index = factorize_groups(keys)
+    # Column-major, so that the columns are summed without copying them.
+    weighted = np.empty((len(codes), len(values)), order="F")
+    for i, val in enumerate(values.values()):
+        weighted[:, i] = val
+    if weights is not None:
+        weighted *= np.asarray(weights, dtype=float)[:, None]
+    return pd.DataFrame(
+        group_sums(codes, weighted, len(index)), index=index, columns=list(values)
+    )
@@ -0,0 +1,127 @@
+# cache.py
+
+# Content-hash keyed on-disk cache for the preprocessed AmBIENCe data.
+
+import hashlib
+import os
+import warnings
+from glob import glob
+import pyarrow as pa
+from pyarrow import feather
+
+# Maximum number of cached versions kept per DataFrame, e.g. for the full data and country subsets.
+CACHE_ENTRIES = 4
+
+
+def hash_inputs(paths, *args):
+    """
+    Calculate a content hash over input files and arguments.
+
+    Parameters
+    ----------
+    paths : list
+        paths to the input files, hashed based on their contents in the given order.
+    *args
+        any additional arguments affecting the output, hashed based on their `repr`.
+
+    Returns
+    -------
+    key : str
+        a hexadecimal SHA-256 digest of the inputs.
+    """
+    h = hashlib.sha256()
+    for path in paths:
+        with open(path, "rb") as f:
+            h.update(hashlib.file_digest(f, "sha256").digest())
+    h.update(repr(args).encode())
+    return h.hexdigest()
+
+
+def cached_frame_path(folderpath, name, key):
+    """
+    Form the path to a cached DataFrame.
+
+    Parameters
+    ----------
+    folderpath : str
+        the folder containing the cache files.
+    name : str
+        name of the cached DataFrame.
+    key : str
+        content hash of the inputs of the cached DataFrame.
+
+    Returns
+    -------
+    path : str
+        path to the Feather file of the cached DataFrame.
+    """
+    return os.path.join(folderpath, f"{name}_{key}.feather")
+
+
+def read_cached_frame(folderpath, name, key):
+    """
+    Read a cached DataFrame from an uncompressed, memory-mapped Feather file.
+
+    Parameters
+    ----------
+    folderpath : str
+        the folder containing the cache files.
+    name : str
+        name of the cached DataFrame.
+    key : str
+        content hash of the inputs of the cached DataFrame.
+
+    Returns
+    -------
+    df : DataFrame
+        the cached DataFrame, or `None` if no valid cache exists.
+    """
+    path = cached_frame_path(folderpath, name, key)
+    if not os.path.exists(path):
+        return None
+    os.utime(path)  # Mark as recently used, see `write_cached_frame`.
+    table = feather.read_table(path, memory_map=True)
+    index = table.schema.metadata.get(b"index").decode()
+    return table.to_pandas().set_index(index)
+
+
+def write_cached_frame(df, folderpath, name, key, max_entries=CACHE_ENTRIES):
+    """
+    Write a DataFrame into the cache, evicting the least recently used versions of it beyond `max_entries`.
+
+    The Feather file is written uncompressed to allow memory mapping, and
+    DataFrames Arrow cannot represent, e.g. due to mixed-type columns, are skipped with a warning.
+    Keeping a few versions avoids e.g. runs with and without a country subset evicting each other.
+
+    Parameters
+    ----------
+    df : DataFrame
+        the DataFrame to cache, with a single named index.
+    folderpath : str
+        the folder containing the cache files.
+    name : str
+        name of the cached DataFrame.
+    key : str
+        content hash of the inputs of the DataFrame.
+    max_entries : int
+        maximum number of cached versions of the DataFrame to keep, including the new one.
+    """
+    try:
+        table = pa.Table.from_pandas(df.reset_index(), preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+        warnings.warn(f"Unable to cache `{name}`: {e}")
+        return
+    table = table.replace_schema_metadata(
+        table.schema.metadata | {b"index": df.index.name.encode()}
+    )
+    os.makedirs(folderpath, exist_ok=True)
+    path = cached_frame_path(folderpath, name, key)
+    feather.write_feather(table, path + ".tmp", compression="uncompressed")
+    os.replace(path + ".tmp", path)
+    paths = sorted(
+        glob(cached_frame_path(folderpath, name, "*")),
+        key=os.path.getmtime,
+        reverse=True,
+    )
+    for stale_path in paths[max_entries:]:
+        os.remove(stale_path)
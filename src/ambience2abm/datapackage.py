@@ -0,0 +1,113 @@
+# datapackage.py
+
+# Data package descriptors built directly from the exported tables.
+
+import pandas as pd
+from frictionless import Package, Resource
+from .identifiers import materialize_labels
+
+# Media types of the supported export formats, keyed by the file extension.
+MEDIATYPES = {
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.file",
+}
+
+# Strings in ISO 8601 date format are declared as dates, like frictionless would infer.
+ISO_DATE_PATTERN = r"^\d{4}-\d{2}-\d{2}$"
+
+
+def field_type(series):
+    """
+    Determine the Table Schema field type of a column based on its dtype.
+
+    Parameters
+    ----------
+    series : Series
+        the column of a table to be exported.
+
+    Returns
+    -------
+    type : str
+        the Table Schema field type.
+    """
+    if pd.api.types.is_bool_dtype(series):
+        return "boolean"
+    if pd.api.types.is_integer_dtype(series):
+        return "integer"
+    if pd.api.types.is_float_dtype(series):
+        return "number"
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return "datetime"
+    values = series.dropna()
+    if (
+        len(values) > 0
+        and values.map(type).eq(str).all()
+        and values.str.match(ISO_DATE_PATTERN).all()
+    ):
+        return "date"
+    return "string"
+
+
+def table_schema(df):
+    """
+    Build a Table Schema for a table, including its index.
+
+    The index is declared as the primary key if it is unique,
+    and categorical identifiers are typed by their labels.
+
+    Parameters
+    ----------
+    df : DataFrame
+        the table to be exported.
+
+    Returns
+    -------
+    schema : dict
+        the Table Schema descriptor.
+    """
+    flat = materialize_labels(df.reset_index())
+    schema = {
+        "fields": [{"name": col, "type": field_type(flat[col])} for col in flat.columns]
+    }
+    if df.index.is_unique:
+        schema["primaryKey"] = list(df.index.names)
+    return schema
+
+
+def create_package(schemas, folderpath, format="csv"):
+    """
+    Create a Package with resources described by the given Table Schemas.
+
+    Parameters
+    ----------
+    schemas : dict
+        the Table Schemas of the exported tables, see `table_schema`,
+        keyed by their file names without the file extension.
+    folderpath : str
+        the folder path where the tables are exported.
+    format : str
+        the file format of the exported tables, one of `MEDIATYPES`.
+
+    Returns
+    -------
+    pkg
+        a Package object with resources for the tables, sorted by name.
+    """
+    return Package(
+        resources=[
+            Resource.from_descriptor(
+                {
+                    "name": name,
+                    "type": "table",
+                    "path": folderpath + name + "." + format,
+                    "scheme": "file",
+                    "format": format,
+                    "mediatype": MEDIATYPES[format],
+                    "schema": schemas[name],
+                }
+                | ({"encoding": "utf-8"} if format == "csv" else {})
+            )
+            for name in sorted(schemas)
+        ]
+    )
@@ -0,0 +1,276 @@
+# export.py
+
+# Concurrent and atomic export of the processed tables.
+
+import heapq
+import os
+import pickle
+import tempfile
+import time
+import pandas as pd
+import pyarrow as pa
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from operator import itemgetter
+from pyarrow import feather, parquet
+from .identifiers import materialize_labels
+
+# Number of rows per pickled batch when spilling sorted chunks to disk, see `write_csv_chunks`.
+SPILL_BATCH_SIZE = 1000
+
+
+def write_atomically(path, write):
+    """
+    Write a file via a temporary file and a rename, so that readers never see a partial file.
+
+    Parameters
+    ----------
+    path : str
+        path to the file to be written.
+    write : function
+        a function writing the file contents into the temporary path given as its argument.
+
+    Returns
+    -------
+    bytes : int
+        size of the written file in bytes.
+    """
+    tmp_path = path + ".tmp"
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return os.path.getsize(path)
+
+
+def arrow_table(df):
+    """
+    Convert a table into a typed Arrow table, with its index as dictionary-encoded columns.
+
+    Parameters
+    ----------
+    df : DataFrame
+        the table to convert.
+
+    Returns
+    -------
+    table : pyarrow.Table
+        the table with the index levels as leading columns.
+    """
+    flat = df.reset_index()
+    for col in flat.columns[: df.index.nlevels]:
+        if not pd.api.types.is_numeric_dtype(flat[col]):
+            flat[col] = flat[col].astype("category")
+    return pa.Table.from_pandas(flat, preserve_index=False)
+
+
+def write_csv(df, path):
+    """Write a table into a .csv file."""
+    df.to_csv(path)
+
+
+def write_parquet(df, path):
+    """Write a table into a .parquet file."""
+    parquet.write_table(arrow_table(df), path)
+
+
+def write_arrow(df, path):
+    """Write a table into an uncompressed, memory-mappable Arrow IPC .arrow file."""
+    feather.write_feather(arrow_table(df), path, compression="uncompressed")
+
+
+def spill_sorted_chunk(df, path):
+    """
+    Spill the rendered .csv lines of a sorted chunk to disk, along with their index keys for merging.
+
+    Parameters
+    ----------
+    df : DataFrame
+        the sorted chunk of a table.
+    path : str
+        path to the spill file.
+    """
+    lines = [line + os.linesep for line in df.to_csv(header=False).split(os.linesep)]
+    lines.pop()  # The last line break is followed by nothing.
+    if len(lines) != len(df):
+        raise ValueError(
+            "Unable to export tables with line breaks in their values in chunks."
+        )
+    keys = df.index.tolist()
+    with open(path, "wb") as f:
+        for start in range(0, len(df), SPILL_BATCH_SIZE):
+            end = start + SPILL_BATCH_SIZE
+            pickle.dump(list(zip(keys[start:end], lines[start:end])), f)
+
+
+def read_spilled_chunk(path):
+    """Iterate over the index keys and .csv lines of a spilled chunk, see `spill_sorted_chunk`."""
+    with open(path, "rb") as f:
+        while True:
+            try:
+                yield from pickle.load(f)
+            except EOFError:
+                return
+
+
+def write_csv_chunks(chunks, path, sort=True):
+    """
+    Write a table given in chunks into a .csv file, identical to writing the concatenated table.
+
+    Sorted chunks are spilled to disk one at a time and merged by their index,
+    so that only one chunk is held in memory at a time.
+    The chunks must have disjoint indexes, e.g. by including the `location_id`.
+
+    Parameters
+    ----------
+    chunks : iterable
+        the chunks of the table as DataFrames with identical columns.
+    path : str
+        path to the .csv file.
+    sort : bool
+        Flag to sort the table by its index, otherwise the chunks are written in the given order.
+    """
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(path) or ".") as spill_dir:
+        header, spills = None, []
+        with open(path, "w", newline="") as f:
+            for i, df in enumerate(chunks):
+                df = materialize_labels(df)
+                if header is None:
+                    header = df.iloc[:0].to_csv()
+                    f.write(header)
+                if sort:
+                    spills.append(os.path.join(spill_dir, f"{i}.pickle"))
+                    spill_sorted_chunk(df.sort_index(), spills[-1])
+                else:
+                    f.write(df.to_csv(header=False))
+            if header is None:
+                raise ValueError("Unable to export a table without any chunks.")
+            f.writelines(
+                line
+                for _, line in heapq.merge(
+                    *(read_spilled_chunk(spill) for spill in spills), key=itemgetter(0)
+                )
+            )
+
+
+# Table writers for the supported export formats, keyed by the file extension.
+WRITERS = {"csv": write_csv, "parquet": write_parquet, "arrow": write_arrow}
+
+
+def export_table(df, path, sort=True, format="csv"):
+    """
+    Sort and export a table atomically, with categorical identifiers written as their labels.
+
+    Parameters
+    ----------
+    df : DataFrame
+        the table to export.
+    path : str
+        path to the exported file.
+    sort : bool
+        Flag to sort the table by its index before exporting.
+    format : str
+        the file format, one of `WRITERS`.
+
+    Returns
+    -------
+    report : dict
+        the size of the written file in bytes and the time it took in seconds.
+    """
+    start = time.perf_counter()
+    df = materialize_labels(df)
+    if sort:
+        df = df.sort_index()
+    size = write_atomically(path, partial(WRITERS[format], df))
+    return {"bytes": size, "seconds": time.perf_counter() - start}
+
+
+def export_table_chunks(chunks, path, sort=True, format="csv"):
+    """
+    Export a table computed in chunks atomically with bounded memory, see `write_csv_chunks`.
+
+    Parameters
+    ----------
+    chunks : iterable
+        the chunks of the table to export, computed lazily one at a time.
+    path : str
+        path to the exported file.
+    sort : bool
+        Flag to sort the table by its index.
+    format : str
+        the file format, only 'csv' is supported.
+
+    Returns
+    -------
+    report : dict
+        the size of the written file in bytes and the time it took in seconds.
+    """
+    if format != "csv":
+        raise ValueError(
+            f"Unable to export `{format}` files in chunks, only `csv` is supported."
+        )
+    start = time.perf_counter()
+    size = write_atomically(path, partial(write_csv_chunks, chunks, sort=sort))
+    return {"bytes": size, "seconds": time.perf_counter() - start}
+
+
+def export_tables(
+    tables,
+    folderpath,
+    unsorted_tables=(),
+    max_workers=None,
+    format="csv",
+    chunked_tables={},
+):
+    """
+    Sort and export tables concurrently on a thread pool.
+
+    Tables given in chunks are exported afterwards one at a time to bound memory use, see `export_table_chunks`.
+
+    Parameters
+    ----------
+    tables : dict
+        tables to export, keyed by their file names without the file extension.
+    folderpath : str
+        the folder path where to export the tables.
+    unsorted_tables : iterable
+        names of the tables exported in their existing order instead of sorting by index.
+    max_workers : int
+        maximum number of threads, `None` uses the `ThreadPoolExecutor` default.
+    format : str
+        the file format, one of `WRITERS`, .csv by default.
+    chunked_tables : dict
+        tables to export given as iterables of chunks, keyed by their file names without the file extension.
+
+    Returns
+    -------
+    report : DataFrame
+        the size in bytes and write time in seconds for each exported file.
+    """
+    if format not in WRITERS:
+        raise ValueError(
+            f"Unknown export format `{format}`, expected one of {list(WRITERS)}."
+        )
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            f"{name}.{format}": pool.submit(
+                export_table,
+                df,
+                os.path.join(folderpath, f"{name}.{format}"),
+                sort=name not in unsorted_tables,
+                format=format,
+            )
+            for name, df in tables.items()
+        }
+        report = {file: future.result() for file, future in futures.items()}
+    for name, chunks in chunked_tables.items():
+        report[f"{name}.{format}"] = export_table_chunks(
+            chunks,
+            os.path.join(folderpath, f"{name}.{format}"),
+            sort=name not in unsorted_tables,
+            format=format,
+        )
+    return pd.DataFrame.from_dict(report, orient="index").rename_axis("file")
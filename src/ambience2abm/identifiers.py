@@ -0,0 +1,144 @@
+# identifiers.py
+
+# Identifier columns held as categoricals, with string labels materialised only on export.
+
+import numpy as np
+import pandas as pd
+
+# Identifier columns of the preprocessed AmBIENCe data held as categoricals,
+# along with the labels repeated from the mapping files.
+IDENTIFIER_COLUMNS = [
+    "building_type",
+    "building_period",
+    "location_id",
+    "building_stock",
+    "category",
+    "HEATING SYSTEM 1 HEAT SOURCE",
+    "HEATING SYSTEM 2 HEAT SOURCE",
+    "HEATING SYSTEM 3 HEAT SOURCE",
+    "shapefile_path",
+    "raster_weight_path",
+    "notes",
+    "notes_building_type",
+]
+
+
+def categorize(df, columns=IDENTIFIER_COLUMNS):
+    """
+    Convert identifier columns into categoricals with lexically sorted categories.
+
+    The categories are sorted so that grouping and sorting by the codes matches
+    sorting by the labels. Missing columns and existing categoricals are left as is.
+
+    Parameters
+    ----------
+    df : DataFrame
+        the table with identifier columns.
+    columns : list
+        names of the identifier columns.
+
+    Returns
+    -------
+    df : DataFrame
+        the same table with the identifier columns as categoricals.
+    """
+    return df.astype(
+        {
+            col: "category"
+            for col in columns
+            if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype)
+        }
+    )
+
+
+def concatenate_labels(*parts):
+    """
+    Concatenate columns and strings into a categorical label column.
+
+    The labels are only formed once for each unique combination of the columns,
+    instead of concatenating the strings of every row.
+    Like with string concatenation, missing strings result in missing labels.
+
+    Parameters
+    ----------
+    *parts : Series or str
+        the columns to concatenate, formatted with `str`, and the separators between them.
+
+    Returns
+    -------
+    labels : Series
+        the concatenated labels as a categorical with lexically sorted categories.
+    """
+    columns = [part for part in parts if isinstance(part, pd.Series)]
+    # Combine the codes of the columns into a single key, with zero for missing values.
+    keys = np.zeros(len(columns[0]), dtype=np.int64)
+    uniques = []
+    for col in columns:
+        col_codes, col_uniques = pd.factorize(col)
+        keys = keys * (len(col_uniques) + 1) + col_codes + 1
+        uniques.append(col_uniques)
+    codes, combinations = pd.factorize(keys)
+    digits = []
+    for col_uniques in reversed(uniques):
+        combinations, digit = np.divmod(combinations, len(col_uniques) + 1)
+        digits.insert(0, digit)
+    # Numbers are formatted like `Series.apply(str)`, missing ones included.
+    numeric = [pd.api.types.is_numeric_dtype(col.dtype) for col in columns]
+    labels = []
+    for combination in zip(*digits):
+        values = iter(zip(combination, uniques, numeric))
+        label = ""
+        for part in parts:
+            if isinstance(part, pd.Series):
+                digit, col_uniques, is_numeric = next(values)
+                if digit == 0 and not is_numeric:
+                    label = None
+                    break
+                part = str(col_uniques[digit - 1] if digit else np.nan)
+            label += part
+        labels.append(label)
+    categories = pd.Index(sorted({label for label in labels if label is not None}))
+    return pd.Series(
+        pd.Categorical.from_codes(
+            categories.get_indexer(labels)[codes], categories=categories
+        ),
+        index=columns[0].index,
+    )
+
+
+def materialize_labels(df):
+    """
+    Convert categorical columns and index levels back into plain labels for exporting.
+
+    The tables are then sorted and written exactly like tables built with plain labels,
+    including the order of duplicate index entries.
+
+    Parameters
+    ----------
+    df : DataFrame
+        the table with categorical columns or index levels.
+
+    Returns
+    -------
+    df : DataFrame
+        the same table with the categoricals replaced by their labels.
+    """
+    if any(
+        isinstance(df.index.get_level_values(level).dtype, pd.CategoricalDtype)
+        for level in range(df.index.nlevels)
+    ):
+        index = materialize_labels(df.index.to_frame(index=False))
+        df = df.set_axis(
+            (
+                pd.MultiIndex.from_frame(index)
+                if df.index.nlevels > 1
+                else pd.Index(index.iloc[:, 0], name=df.index.name)
+            ),
+            axis=0,
+        )
+    categoricals = {
+        col: dtype.categories.dtype
+        for col, dtype in df.dtypes.items()
+        if isinstance(dtype, pd.CategoricalDtype)
+    }
+    return df.astype(categoricals) if categoricals else df
@@ -0,0 +1,224 @@
+# manifest.py
+
+# Content-hash build manifest for incremental data package updates.
+
+import json
+import os
+from glob import glob
+from .cache import hash_inputs
+from .datapackage import table_schema
+from .export import export_tables, write_atomically
+
+# Input and output hashes of the last build, relative to the repository root.
+MANIFEST_PATH = ".cache/build_manifest.json"
+
+
+def read_manifest(path):
+    """
+    Read a build manifest, or start a new one if it doesn't exist.
+
+    Parameters
+    ----------
+    path : str
+        path to the build manifest .json file.
+
+    Returns
+    -------
+    manifest : dict
+        the `outputs` keyed by path, with the content hashes of each output and the inputs it was built from.
+    """
+    if not os.path.exists(path):
+        return {"outputs": {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_manifest(manifest, path):
+    """
+    Write a build manifest atomically.
+
+    Parameters
+    ----------
+    manifest : dict
+        the build manifest, see `read_manifest`.
+    path : str
+        path to the build manifest .json file.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    def write(tmp_path):
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=4, sort_keys=True)
+
+    write_atomically(path, write)
+
+
+def code_digest():
+    """
+    Calculate a content hash of the `ambience2abm` source code, so that code changes trigger rebuilds.
+
+    Returns
+    -------
+    key : str
+        a hexadecimal SHA-256 digest of the package source files.
+    """
+    return hash_inputs(sorted(glob(os.path.join(os.path.dirname(__file__), "*.py"))))
+
+
+def is_stale(record, inputs, path):
+    """
+    Check whether an output needs to be rebuilt.
+
+    Parameters
+    ----------
+    record : dict
+        the manifest record of the output, `None` if it has never been built.
+    inputs : dict
+        the current content hashes of the inputs of the output.
+    path : str
+        path to the output file.
+
+    Returns
+    -------
+    stale : bool
+        `True` if the output is missing, its inputs have changed, or it has been modified since it was built.
+    """
+    return (
+        record is None
+        or record["inputs"] != inputs
+        or not os.path.exists(path)
+        or hash_inputs([path]) != record["digest"]
+    )
+
+
+def schema_of_chunks(chunks, schemas, table):
+    """
+    Pass through the chunks of a table, recording its Table Schema once all chunks have been seen.
+
+    The field types are based on the first chunk, and the index is declared as the primary key
+    if it is unique within every chunk, as the chunks have disjoint indexes.
+
+    Parameters
+    ----------
+    chunks : iterable
+        the chunks of the table.
+    schemas : dict
+        the Table Schemas keyed by table name, where the schema of the `table` is recorded.
+    table : str
+        name of the table.
+
+    Returns
+    -------
+    chunks : generator
+        the same chunks.
+    """
+    schema, unique = None, True
+    for chunk in chunks:
+        if schema is None:
+            schema = table_schema(chunk)
+        unique = unique and chunk.index.is_unique
+        yield chunk
+    if not unique:
+        schema.pop("primaryKey", None)
+    schemas[table] = schema
+
+
+def update_package(
+    dataset,
+    folderpath,
+    descriptor_path,
+    manifest,
+    format="csv",
+    max_workers=None,
+    streaming=False,
+    chunk_rows=None,
+):
+    """
+    Recompute and export only the tables whose inputs have changed, and update the data package descriptor if needed.
+
+    The manifest isn't modified, so that packages can be updated in parallel processes,
+    instead the new records are returned for merging into `manifest["outputs"]`.
+    When streaming, the `streamed_tables` of the dataset are computed and exported in chunks
+    to bound memory use, see `export.export_table_chunks`.
+
+    Parameters
+    ----------
+    dataset : ABMDataset or ABMDefinitions
+        the data package contents.
+    folderpath : str
+        the folder path where to export the tables.
+    descriptor_path : str
+        path to the data package descriptor .json file.
+    manifest : dict
+        the build manifest of the previous update, see `read_manifest`.
+    format : str
+        the file format, see `export.WRITERS`.
+    max_workers : int
+        maximum number of threads for sorting and writing the tables.
+    streaming : bool
+        Flag to export the `streamed_tables` in chunks, only for 'csv'.
+    chunk_rows : int
+        maximum number of rows of AmBIENCe data per streamed chunk, `None` for a single country per chunk,
+        see `ABMDataset.table_chunks`.
+
+    Returns
+    -------
+    report : DataFrame
+        the size in bytes and write time in seconds for each exported file.
+    records : dict
+        the manifest records of the rewritten tables and descriptor, keyed by path.
+    """
+    code = code_digest()
+    dependencies = dataset.table_dependencies()
+    records = {}
+    outputs = manifest["outputs"]
+    paths = {table: folderpath + table + "." + format for table in dataset.tables}
+    inputs = {table: dependencies[table] | {"ambience2abm": code} for table in paths}
+    stale = [
+        table
+        for table, path in paths.items()
+        if is_stale(outputs.get(path), inputs[table], path)
+    ]
+    streamed = [
+        table for table in stale if streaming and table in dataset.streamed_tables
+    ]
+    tables = {
+        table: dataset.get_table(table) for table in stale if table not in streamed
+    }
+    new_schemas = {table: table_schema(df) for table, df in tables.items()}
+    report = export_tables(
+        tables,
+        folderpath,
+        unsorted_tables=dataset.unsorted_tables,
+        max_workers=max_workers,
+        format=format,
+        chunked_tables={
+            table: schema_of_chunks(
+                dataset.table_chunks(table, chunk_rows), new_schemas, table
+            )
+            for table in streamed
+        },
+    )
+    for table in stale:
+        records[paths[table]] = {
+            "inputs": inputs[table],
+            "digest": hash_inputs([paths[table]]),
+            "schema": new_schemas[table],
+        }
+    # The descriptor only depends on the paths and schemas of the exported files, not their contents.
+    schemas = {
+        table: (records.get(path) or outputs[path])["schema"]
+        for table, path in paths.items()
+    }
+    descriptor_inputs = {
+        paths[table]: hash_inputs([], schema) for table, schema in schemas.items()
+    } | {"ambience2abm": code}
+    if is_stale(outputs.get(descriptor_path), descriptor_inputs, descriptor_path):
+        dataset.create_datapackage(folderpath, format=format, schemas=schemas).to_json(
+            descriptor_path
+        )
+        records[descriptor_path] = {
+            "inputs": descriptor_inputs,
+            "digest": hash_inputs([descriptor_path]),
+        }
+    return report, records
@@ -3,11 +3,242 @@
 # Classes and methods for processing the AmBIENCe datasets.
 
 import pandas as pd
+from pandas.api.types import union_categoricals
 import numpy as np
 from . import __version__
-from itertools import product
-from frictionless import Package
+from .datapackage import create_package, table_schema
+from .export import export_tables
+from .aggregation import normalize_weights, weighted_sums
+from .cache import hash_inputs, read_cached_frame, write_cached_frame
+from .manifest import code_digest
+from .identifiers import categorize, concatenate_labels
+from .spine_db import import_mapped_data, map_tables
+from .reader import (
+    STRUCTURE_PROPERTIES,
+    WINDOW_COLUMNS,
+    read_ambience_workbooks,
+    required_columns,
+)
+from .structure_physics import (
+    calculate_effective_thermal_mass_array,
+    calculate_U_value_arrays,
+)
+import copy
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from functools import cached_property, partial, wraps
+
+# Inputs of the preprocessed and extrapolated AmBIENCe data, see `AmBIENCeDataset.input_digests`.
+AMBIENCE_INPUTS = [
+    "building_stock_properties",
+    "building_stock_heatsys",
+    "building_type_mappings",
+    "shapefile_mappings",
+    "building_stock_year",
+    "heatsys_skiprows",
+    "extrapolations",
+    "country_subset",
+]
+
+# Ventilation and fenestration assumptions that can be sampled, see `AmBIENCeDataset.sample_ventilation_and_fenestration_statistics`.
+UNCERTAIN_PARAMETERS = [
+    "HRU_efficiency",
+    "infiltration_rate_1_h",
+    "ventilation_rate_1_h",
+    "normal_solar_energy_transmittance",
+    "frame_area_fraction",
+]
+
+
+def validate_distributions(distributions):
+    """
+    Check the distributions of uncertain parameters, filling in the optional `relative` column.
+
+    Parameters
+    ----------
+    distributions : DataFrame
+        the distributions indexed by `parameter`, with the `distribution` either 'uniform' between `low` and `high`,
+        or 'triangular' between `low` and `high` peaking at `mode`, and optionally whether the samples are `relative`.
+
+    Returns
+    -------
+    distributions : DataFrame
+        the same distributions, with `relative` defaulting to False.
+    """
+    for param, dist in distributions.iterrows():
+        if dist["distribution"] not in ("uniform", "triangular"):
+            raise ValueError(
+                f"Unknown distribution `{dist['distribution']}` for `{param}`, expected 'uniform' or 'triangular'."
+            )
+        bounds = (
+            ["low", "mode", "high"]
+            if dist["distribution"] == "triangular"
+            else ["low", "high"]
+        )
+        if not all(
+            dist[lower] <= dist[upper] for lower, upper in zip(bounds, bounds[1:])
+        ):
+            raise ValueError(
+                f"Invalid {dist['distribution']} distribution for `{param}`, "
+                f"expected {' <= '.join(bounds)} but got {', '.join(f'{bound}={dist[bound]}' for bound in bounds)}."
+            )
+    relative = distributions.get(
+        "relative", pd.Series(False, index=distributions.index)
+    )
+    return distributions.assign(relative=relative.fillna(False).astype(bool))
+
+
+def sample_distributions(distributions, samples, rng):
+    """
+    Draw samples from the distributions of uncertain parameters.
+
+    Parameters
+    ----------
+    distributions : DataFrame
+        the distributions indexed by `parameter`, see `validate_distributions`.
+    samples : int
+        number of samples to draw for each parameter.
+    rng : numpy.random.Generator
+        the random number generator.
+
+    Returns
+    -------
+    sampled : dict
+        arrays of samples keyed by parameter.
+    """
+    sampled = {}
+    for param, dist in validate_distributions(distributions).iterrows():
+        if dist["distribution"] == "uniform":
+            sampled[param] = rng.uniform(dist["low"], dist["high"], samples)
+        else:
+            sampled[param] = rng.triangular(
+                dist["low"], dist["mode"], dist["high"], samples
+            )
+    return sampled
+
+
+def statistics_key(dataset, name):
+    """
+    Form the key of memoized `AmBIENCeDataset` statistics.
+
+    Parameters
+    ----------
+    dataset : AmBIENCeDataset
+        the dataset the statistics are calculated for.
+    name : str
+        name of the memoized method.
+
+    Returns
+    -------
+    key : tuple
+        the method name, data version, and physics parameters.
+    """
+    return (
+        name,
+        dataset.data_version,
+        dataset.interior_node_depth,
+        dataset.period_of_variations,
+    )
+
+
+def memoize_statistics(method):
+    """
+    Memoize `AmBIENCeDataset` statistics based on the data version and physics parameters.
+
+    Shallow copies of the memoized DataFrames are returned to protect them from modification.
+    Memoized results for outdated data versions are discarded on the next miss.
+
+    Parameters
+    ----------
+    method : function
+        an `AmBIENCeDataset` method without arguments returning a DataFrame.
+
+    Returns
+    -------
+    wrapper : function
+        the memoized method.
+    """
+
+    @wraps(method)
+    def wrapper(self):
+        key = statistics_key(self, method.__name__)
+        if key in self.statistics_cache:
+            self.statistics_cache_stats["hits"] += 1
+        else:
+            self.statistics_cache_stats["misses"] += 1
+            self.statistics_cache = {
+                k: v
+                for k, v in self.statistics_cache.items()
+                if k[1] == self.data_version
+            }
+            self.statistics_cache[key] = method(self)
+        return self.statistics_cache[key].copy(deep=False)
+
+    return wrapper
+
+
+# Memoized statistics grouped by `location_id`, see `AmBIENCeDataset.calculate_statistics_by_country`.
+COUNTRY_STATISTICS = [
+    "calculate_building_stock_statistics",
+    "calculate_structure_statistics",
+    "calculate_ventilation_and_fenestration_statistics",
+]
+
+# The dataset shared with the tasks of a worker process, see `share_dataset`.
+shared_dataset = None
+
+
+def share_dataset(dataset):
+    """
+    Share a dataset with the tasks of a worker process, set once per process via the pool initializer.
+
+    Parameters
+    ----------
+    dataset : AmBIENCeDataset
+        the dataset to share, inherited without pickling when the worker processes are forked.
+    """
+    global shared_dataset
+    shared_dataset = dataset
+
+
+def calculate_country_statistics(shard):
+    """
+    Calculate the `COUNTRY_STATISTICS` of a country shard, e.g. in a worker process.
+
+    Parameters
+    ----------
+    shard : AmBIENCeDataset
+        the dataset of a single country, see `AmBIENCeDataset.country_shard`.
+
+    Returns
+    -------
+    statistics : dict
+        the statistics keyed by method name, and the `structure_physics_stats` of the country.
+    """
+    return {name: getattr(shard, name)() for name in COUNTRY_STATISTICS} | {
+        "structure_physics_stats": shard.structure_physics_stats
+    }
+
+
+def sweep_shared_structure_statistics(interior_node_depths, periods_of_variations):
+    """
+    Sweep the structure statistics of the shared dataset for a chunk of the interior node depths.
+
+    Parameters
+    ----------
+    interior_node_depths : array
+        the interior node depths of the chunk.
+    periods_of_variations : array
+        the periods of variations in seconds.
+
+    Returns
+    -------
+    structural_statistics
+        a DataFrame of the chunk, see `AmBIENCeDataset.sweep_structure_statistics`.
+    """
+    return shared_dataset.sweep_structure_statistics(
+        interior_node_depths, periods_of_variations
+    )
 
 
 class AmBIENCeDataset:
@@ -26,10 +257,20 @@ class AmBIENCeDataset:
         interior_node_depth=0.1,
         period_of_variations=1209600,
         heatsys_skiprows=[0],
+        cache_folderpath=".cache/",
+        project_columns=True,
+        excel_engine=None,
+        countries=None,
+        extrapolation_mappings={},
     ):
         """
         Read the AmBIENCe project raw data and assumptions.
 
+        The preprocessed data is cached on disk based on the contents of the raw data files and assumptions,
+        so that subsequent reads with unchanged inputs skip parsing the raw data.
+        A subset of countries is filtered from the cached data of all countries if available,
+        and otherwise processed and cached separately.
+
         Parameters
         ----------
         building_stock_properties_path : str
@@ -54,31 +295,133 @@ class AmBIENCeDataset:
             assumed period of variations in seconds for the 'EN ISO 13786:2017 Annex C.2.4 Effective thickness method'.
         heatsys_skiprows : array
             row indices to skip when reading AmBIENCe heating system data.
+        cache_folderpath : str
+            folder for caching the preprocessed data, `None` disables caching.
+        project_columns : bool
+            Flag to only read the raw data columns required for processing, see `reader.required_columns`.
+        excel_engine : str
+            `pandas.read_excel` engine for reading the raw data, e.g. 'calamine' if installed.
+        countries : iterable
+            the countries to process, including countries created via `extrapolate`, `None` processes all countries.
+        extrapolation_mappings : dict
+            the `mappings` later passed to `extrapolate`, so that the source countries of requested
+            extrapolated countries are read as well, until dropped by `extrapolate`.
         """
-        self.structure_types = pd.read_csv(structure_types_path).set_index(
-            "structure_type"
+        self.countries = None if countries is None else sorted(set(countries))
+        self.interior_node_depth = interior_node_depth
+        self.period_of_variations = period_of_variations
+        self.building_stock_year = building_stock_year
+        self.heatsys_skiprows = heatsys_skiprows
+        # Input files and extrapolations are recorded for incremental updates, see `input_digests`.
+        self.input_paths = {
+            "building_stock_properties": building_stock_properties_path,
+            "building_stock_heatsys": building_stock_heatsys_path,
+            "structure_types": structure_types_path,
+            "building_type_mappings": building_type_mappings_path,
+            "shapefile_mappings": shapefile_mappings_path,
+            "fenestration": fenestration_path,
+            "ventilation": ventilation_path,
+        }
+        self.extrapolations = []
+        self.structure_physics_stats = {}
+        self.scenario_physics_stats = {}
+        # Derived statistics are memoized per data version, see `memoize_statistics`.
+        self.data_version = 0
+        self.statistics_cache = {}
+        self.statistics_cache_stats = {"hits": 0, "misses": 0}
+        self.read_assumptions()
+        # Read preprocessed data from cache if the inputs are unchanged.
+        # Only the raw data, the mappings joined into it, and the projected columns affect the preprocessed data.
+        columns = (
+            required_columns(self.structure_types["mapping"])
+            if project_columns
+            else None
         )
+        # Countries read from the raw data, including the sources of requested extrapolated countries.
+        read_countries = (
+            None
+            if countries is None
+            else sorted(
+                set(countries)
+                | {
+                    source
+                    for source, (target, _) in extrapolation_mappings.items()
+                    if target in self.countries
+                }
+            )
+        )
+        self.data = None
+        if cache_folderpath is not None:
+            cache_keys = [
+                hash_inputs(
+                    [
+                        building_stock_properties_path,
+                        building_stock_heatsys_path,
+                        building_type_mappings_path,
+                        shapefile_mappings_path,
+                    ],
+                    building_stock_year,
+                    heatsys_skiprows,
+                    columns,
+                    code_digest(),
+                    *subset,
+                )
+                for subset in ([], [read_countries])
+            ]
+            self.data = read_cached_frame(cache_folderpath, "ambience", cache_keys[0])
+            if self.data is not None and read_countries is not None:
+                self.data = self.data[self.data["location_id"].isin(read_countries)]
+            elif read_countries is not None:
+                self.data = read_cached_frame(
+                    cache_folderpath, "ambience", cache_keys[1]
+                )
+            if self.data is not None:
+                # Older caches hold the identifiers as plain strings.
+                self.data = categorize(self.data)
+        if self.data is None:
+            self.data = self.preprocess_data(
+                building_stock_properties_path,
+                building_stock_heatsys_path,
+                building_stock_year,
+                heatsys_skiprows,
+                project_columns=project_columns,
+                excel_engine=excel_engine,
+                countries=read_countries,
+            )
+            if cache_folderpath is not None:
+                write_cached_frame(
+                    self.data,
+                    cache_folderpath,
+                    "ambience",
+                    cache_keys[read_countries is not None],
+                )
+
+    def read_assumptions(self):
+        """
+        Read the assumption files in `input_paths`, e.g. to reload them after editing.
+
+        Bumps `self.data_version` to invalidate memoized statistics.
+        Note that changes to the building type or shapefile mappings,
+        or to the AmBIENCe structures the structure types are mapped to,
+        require reading the AmBIENCeDataset anew to take effect.
+        """
+        self.structure_types = pd.read_csv(
+            self.input_paths["structure_types"]
+        ).set_index("structure_type")
         self.building_type_mappings = pd.read_csv(
-            building_type_mappings_path
+            self.input_paths["building_type_mappings"]
         ).set_index("building_type")
-        self.shapefile_mappings = pd.read_csv(shapefile_mappings_path).set_index(
-            "country"
-        )
-        self.interior_node_depth = interior_node_depth
-        self.period_of_variations = period_of_variations
-        self.fenestration = pd.read_csv(fenestration_path).set_index(
+        self.shapefile_mappings = pd.read_csv(
+            self.input_paths["shapefile_mappings"]
+        ).set_index("country")
+        self.fenestration = pd.read_csv(self.input_paths["fenestration"]).set_index(
             [
                 "REFERENCE BUILDING WINDOW GLAZING TYPE",
                 "REFERENCE BUILDING WINDOW COATED",
             ]
         )
-        self.ventilation = pd.read_csv(ventilation_path)
-        self.data = self.preprocess_data(
-            building_stock_properties_path,
-            building_stock_heatsys_path,
-            building_stock_year,
-            heatsys_skiprows,
-        )
+        self.ventilation = pd.read_csv(self.input_paths["ventilation"])
+        self.data_version += 1  # Invalidate memoized statistics.
 
     def preprocess_data(
         self,
@@ -86,6 +429,9 @@ class AmBIENCeDataset:
         building_stock_heatsys_path,
         building_stock_year,
         heatsys_skiprows,
+        project_columns=True,
+        excel_engine=None,
+        countries=None,
     ):
         """
         Preprocess AmBIENCe data to make it more manageable.
@@ -100,19 +446,29 @@ class AmBIENCeDataset:
             year the building stock data represents.
         heatsys_skiprows : array
             row indices to skip when reading AmBIENCe heating system data.
+        project_columns : bool
+            Flag to only read the raw data columns required for processing.
+        excel_engine : str
+            `pandas.read_excel` engine for reading the raw data.
+        countries : iterable
+            the countries to read, `None` reads all countries.
 
         Returns
         -------
         data
             a DataFrame containing the combined and extended AmBIENCe data.
         """
-        data = pd.merge(  # Merge the data together to make it easier to deal with.
-            pd.read_excel(building_stock_properties_path),
-            pd.read_excel(
-                building_stock_heatsys_path, skiprows=heatsys_skiprows
-            ),  # Skip first row of header, later headers will be omitted through inner join.
-            left_on="REFERENCE BUILDING CODE",
-            right_on="Building typology",
+        data = read_ambience_workbooks(
+            building_stock_properties_path,
+            building_stock_heatsys_path,
+            heatsys_skiprows=heatsys_skiprows,
+            columns=(
+                required_columns(self.structure_types["mapping"])
+                if project_columns
+                else None
+            ),
+            engine=excel_engine,
+            countries=countries,
         )
         # Rename columns for convenience later on
         data = data.rename(
@@ -136,29 +492,22 @@ class AmBIENCeDataset:
             data[c1] = data[c2]
             data.loc[data[c3] == "District", c1] = "District"
         # Create and add `building_period` to avoid dealing with it manually all the time.
-        data["building_period"] = data[
-            [
-                "REFERENCE BUILDING CONSTRUCTION YEAR LOW",
-                "REFERENCE BUILDING CONSTRUCTION YEAR HIGH",
-            ]
-        ].apply(lambda row: "-".join(row.values.astype(str)), axis=1)
-        # Calculate structure weights for each row
-        col = "average_gross_floor_area_m2_per_building"
-        cols = [
-            "building_type",
-            "building_period",
-            "location_id",
-        ]
-        data = data.set_index(cols)
-        agg_data = data.groupby(cols).agg(
-            total_area_over_material_combinations_m2=(col, sum)
+        data["building_period"] = concatenate_labels(
+            data["REFERENCE BUILDING CONSTRUCTION YEAR LOW"],
+            "-",
+            data["REFERENCE BUILDING CONSTRUCTION YEAR HIGH"],
         )
-        data = data.join(agg_data)
-        data["material_combination_weight"] = (
-            data[col] / data["total_area_over_material_combinations_m2"]
+        # Calculate structure weights for each row, summed like the builtin `sum` for each reference building.
+        cols = ["building_type", "building_period", "location_id"]
+        (
+            data["total_area_over_material_combinations_m2"],
+            data["material_combination_weight"],
+        ) = normalize_weights(
+            {c: data[c] for c in cols},
+            data["average_gross_floor_area_m2_per_building"],
+            compensated=False,
         )
         # Join building type and shapefile mappings for convenience.
-        data = data.reset_index()
         data = data.join(self.shapefile_mappings, on="location_id")
         data = data.join(
             self.building_type_mappings,
@@ -167,15 +516,16 @@ class AmBIENCeDataset:
         )
         # Create `building_stock` label for convenience
         data["building_stock_year"] = building_stock_year
-        data["building_stock"] = (
-            "AmBIENCe_"
-            + data["building_stock_year"].apply(str)
-            + "_"
-            + data["location_id"]
-            + "_"
-            + data["category"]
+        data["building_stock"] = concatenate_labels(
+            "AmBIENCe_",
+            data["building_stock_year"],
+            "_",
+            data["location_id"],
+            "_",
+            data["category"],
         )
-        return data.set_index("REFERENCE BUILDING CODE")
+        # Identifiers are held as categoricals, labels are only written on export.
+        return categorize(data).set_index("REFERENCE BUILDING CODE")
 
     def extrapolate(self, mappings={}, tag="", year=2016):
         """
@@ -186,7 +536,10 @@ class AmBIENCeDataset:
         for the `number_of_buildings` parameter in the `building_stock_statistics`.
         All other parameters are preserved from the origin country data.
 
-        This method doesn't return anything, but instead extends `self.data`.
+        This method doesn't return anything, but instead extends `self.data`,
+        bumps `self.data_version` to invalidate memoized statistics, and records the extrapolation in `self.extrapolations`.
+        If only a subset of `self.countries` is processed, only the requested countries are extrapolated,
+        and the source countries not requested are dropped afterwards.
 
         Parameters
         ----------
@@ -199,6 +552,16 @@ class AmBIENCeDataset:
         """
         data_list = [self.data.reset_index()]
         for c1, (c2, coeff) in mappings.items():
+            if self.countries is not None and c2 not in self.countries:
+                continue
+            if (
+                self.countries is not None
+                and not (self.data["location_id"] == c1).any()
+            ):
+                raise ValueError(
+                    f"Source country `{c1}` of `{c2}` not found in the data, "
+                    "include it in the `extrapolation_mappings` of the AmBIENCeDataset."
+                )
             df = self.data.reset_index().drop(
                 columns=["shapefile_path", "notes"]
             )  # Remove shapefile mappings and notes
@@ -206,24 +569,122 @@ class AmBIENCeDataset:
             df["REFERENCE BUILDING CODE"] = df["REFERENCE BUILDING CODE"].str.replace(
                 c1, c2
             )  # Rename reference building
-            df.location_id = df.location_id.replace(c1, c2)  # Rename country
+            df.location_id = df.location_id.astype(object).replace(
+                c1, c2
+            )  # Rename country
             df = df.join(
                 self.shapefile_mappings, on="location_id"
             )  # Re-join to update shapefile path
-            df.building_stock = (
-                tag
-                + "_"
-                + df.building_stock_year.apply(str)
-                + "_"
-                + df.location_id
-                + "_"
-                + df.category
+            df.building_stock = concatenate_labels(
+                tag + "_",
+                df.building_stock_year,
+                "_",
+                df.location_id,
+                "_",
+                df.category,
             )  # Form new building stock names.
             df.number_of_buildings = (
                 df.number_of_buildings * coeff
             )  # Scale number of buildings
             data_list.append(df)
-        self.data = pd.concat(data_list).set_index("REFERENCE BUILDING CODE")
+        # Categories differ between the countries, so the concatenated identifiers are categorized anew.
+        self.data = categorize(pd.concat(data_list)).set_index(
+            "REFERENCE BUILDING CODE"
+        )
+        if self.countries is not None:
+            self.data = self.data[self.data["location_id"].isin(self.countries)]
+        self.data_version += 1  # Invalidate memoized statistics.
+        self.extrapolations.append((mappings, tag, year))
+
+    def input_digests(self):
+        """
+        Calculate content hashes of the input files and parameters of the dataset.
+
+        Returns
+        -------
+        digests : dict
+            the content hash of each input file in `input_paths` and each parameter, keyed by name.
+        """
+        return (
+            {name: hash_inputs([path]) for name, path in self.input_paths.items()}
+            | {
+                name: hash_inputs([], getattr(self, name))
+                for name in [
+                    "building_stock_year",
+                    "heatsys_skiprows",
+                    "extrapolations",
+                    "interior_node_depth",
+                    "period_of_variations",
+                ]
+            }
+            | {"country_subset": hash_inputs([], self.countries)}
+        )
+
+    def country_shard(self, *location_ids):
+        """
+        Select the data of some countries, e.g. for processing the countries independently.
+
+        Parameters
+        ----------
+        *location_ids : str
+            the countries to select.
+
+        Returns
+        -------
+        shard : AmBIENCeDataset
+            a shallow copy sharing the assumptions, with only the data of the countries and its own memoized statistics,
+            starting from the already memoized statistics of the countries, e.g. via `calculate_statistics_by_country`.
+        """
+        shard = copy.copy(self)
+        shard.data = self.data[self.data["location_id"].isin(location_ids)]
+        shard.statistics_cache = {
+            key: df[df.index.get_level_values("location_id").isin(location_ids)]
+            for key, df in self.statistics_cache.items()
+            if key[0] in COUNTRY_STATISTICS and key[1] == self.data_version
+        }
+        shard.statistics_cache_stats = {"hits": 0, "misses": 0}
+        return shard
+
+    def calculate_statistics_by_country(self, max_workers=None):
+        """
+        Calculate the statistics of each country in parallel worker processes.
+
+        All statistics are grouped by `location_id`, so the countries are independent after preprocessing.
+        Each country is calculated as a separate task, and the results are concatenated and memoized
+        as if calculated directly, see `COUNTRY_STATISTICS`.
+        Each task only carries the data of its country instead of the whole dataset, see `country_shard`.
+
+        This method doesn't return anything, but instead memoizes the statistics
+        and sums the `self.structure_physics_stats` over the countries.
+
+        Parameters
+        ----------
+        max_workers : int
+            maximum number of worker processes, `None` uses the `ProcessPoolExecutor` default.
+        """
+        location_ids = self.data["location_id"].unique()
+        if len(location_ids) == 0:
+            return
+        shards = (self.country_shard(location_id) for location_id in location_ids)
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            results = list(pool.map(calculate_country_statistics, shards))
+        self.statistics_cache = {
+            k: v for k, v in self.statistics_cache.items() if k[1] == self.data_version
+        } | {
+            statistics_key(self, name): pd.concat(
+                [result[name] for result in results]
+            ).sort_index()
+            for name in COUNTRY_STATISTICS
+        }
+        evaluations, unique_evaluations = (
+            sum(result["structure_physics_stats"][key] for result in results)
+            for key in ["evaluations", "unique_evaluations"]
+        )
+        self.structure_physics_stats = {
+            "evaluations": evaluations,
+            "unique_evaluations": unique_evaluations,
+            "hit_ratio": 1 - unique_evaluations / evaluations if evaluations else 0.0,
+        }
 
     def building_stocks(self, for_processing=False):
         """
@@ -283,6 +744,7 @@ class AmBIENCeDataset:
             .drop_duplicates()
         )
 
+    @memoize_statistics
     def calculate_building_stock_statistics(self):
         """
         Process the basic building stock statistics from data for ArchetypeBuildingModel.jl.
@@ -292,48 +754,38 @@ class AmBIENCeDataset:
         building_stock_statistics_df
             a DataFrame for building_stock_statistics.csv export.
         """
-        # Form the new dataframe
+        # Reshape the heating systems from wide to long, row-major to keep the original order.
+        hss = ["HEATING SYSTEM 1", "HEATING SYSTEM 2", "HEATING SYSTEM 3"]
+        cols = ["building_stock", "building_type", "building_period", "location_id"]
+        # Interleave the categorical heat sources row-major via their codes.
+        heat_sources = union_categoricals(
+            [self.data[" ".join([hs, "HEAT SOURCE"])].array for hs in hss],
+            sort_categories=True,
+        ).take(np.arange(len(self.data) * len(hss)).reshape(len(hss), -1).T.ravel())
+        prevalencies = self.data[
+            [" ".join([hs, "PREVALENCY ON BUILDING STOCK"]) for hs in hss]
+        ].to_numpy(dtype=float)
+        # Multiply number of buildings by heat source prevalency.
+        number_of_buildings = (
+            self.data["number_of_buildings"].to_numpy(dtype=float)[:, None]
+            * prevalencies
+        )
         bss = pd.DataFrame(  # Form the basic structure.
-            [
-                [
-                    r["building_stock"],
-                    r["building_type"],
-                    r["building_period"],
-                    r["location_id"],
-                    r[" ".join([hs, "HEAT SOURCE"])],  # Heating system fuel from data.
-                    r["number_of_buildings"]
-                    * r[
-                        " ".join([hs, "PREVALENCY ON BUILDING STOCK"])
-                    ],  # Multiply number of buildings by heat source prevalency.
-                    r[
-                        "average_gross_floor_area_m2_per_building"
-                    ],  # Useful floor area estimated to be roughly equivalent to gross-floor area.
-                ]
-                for ((i, r), hs) in product(
-                    self.data.iterrows(),
-                    ["HEATING SYSTEM 1", "HEATING SYSTEM 2", "HEATING SYSTEM 3"],
-                )
-            ],
-            columns=[
-                "building_stock",
-                "building_type",
-                "building_period",
-                "location_id",
-                "heat_source",
-                "number_of_buildings",
-                "average_gross_floor_area_m2_per_building",
-            ],
+            {col: self.data[col].repeat(len(hss)).array for col in cols}
+            | {
+                "heat_source": heat_sources,
+                "number_of_buildings": number_of_buildings.ravel(),
+                # Useful floor area estimated to be roughly equivalent to gross-floor area.
+                "average_gross_floor_area_m2_per_building": np.repeat(
+                    self.data["average_gross_floor_area_m2_per_building"].to_numpy(),
+                    len(hss),
+                ),
+            }
         )
         return (
             bss.dropna()  # Drop NaN rows with invalid heating system data.
             .groupby(  # Group by the actual dimensions...
-                [
-                    "building_stock",
-                    "building_type",
-                    "building_period",
-                    "location_id",
-                    "heat_source",
-                ]
+                cols + ["heat_source"], observed=True, sort=True
             )
             .agg(  # ... and aggregate over the different structural classes in the raw data.
                 {
@@ -352,6 +804,7 @@ class AmBIENCeDataset:
         Calculate the effective thermal mass according to 'EN ISO 13786:2017 Annex C.2.4 effective thickness method'.
 
         Note that internal structures assume no insulation.
+        See `calculate_effective_thermal_mass_array` for processing whole arrays at once.
 
         Parameters
         ----------
@@ -367,30 +820,21 @@ class AmBIENCeDataset:
         pretext = " ".join(
             ["REFERENCE BUILDING", self.structure_types.loc[st, "mapping"]]
         )
-        shc = (
-            r[" ".join([pretext, "MATERIAL THICKNESS (m)"])]
-            * r[" ".join([pretext, "MATERIAL DENSITY (kg/m3)"])]
-            * r[" ".join([pretext, "MATERIAL SPECIFIC HEAT CAPACITY (J/kg/K)"])]
-            + (
-                not self.structure_types.loc[st, "is_internal"]
-            )  # Internal structures assume no insulation.
-            * 0.5
-            * r[" ".join([pretext, "INSULATION MATERIAL THICKNESS (m)"])]
-            * r[" ".join([pretext, "INSULATION MATERIAL DENSITY (kg/m3)"])]
-            * r[
-                " ".join(
-                    [pretext, "INSULATION MATERIAL SPECIFIC HEAT CAPACITY (J/kg/K)"]
-                )
-            ]
-        )
-        # Apply the period of variations according to 'EN ISO 13786:2017 Annex C.2.4 effective thickness method'
-        return np.sqrt(
-            shc**2
-            / (
-                1
-                + (2 * np.pi / self.period_of_variations) ** 2
-                * shc**2
-                * self.structure_types.loc[st, "interior_resistance_m2K_W"] ** 2
+        return float(
+            calculate_effective_thermal_mass_array(
+                r[" ".join([pretext, "MATERIAL THICKNESS (m)"])],
+                r[" ".join([pretext, "MATERIAL DENSITY (kg/m3)"])],
+                r[" ".join([pretext, "MATERIAL SPECIFIC HEAT CAPACITY (J/kg/K)"])],
+                r[" ".join([pretext, "INSULATION MATERIAL THICKNESS (m)"])],
+                r[" ".join([pretext, "INSULATION MATERIAL DENSITY (kg/m3)"])],
+                r[
+                    " ".join(
+                        [pretext, "INSULATION MATERIAL SPECIFIC HEAT CAPACITY (J/kg/K)"]
+                    )
+                ],
+                self.structure_types.loc[st, "interior_resistance_m2K_W"],
+                self.structure_types.loc[st, "is_internal"],
+                period_of_variations=self.period_of_variations,
             )
         )
 
@@ -400,6 +844,7 @@ class AmBIENCeDataset:
 
         Note that internal structures assume no insulation.
         Ground-coupled heat losses based on 'Kissock. K., Simplified Model for Ground Heat Transfer from Slab-on-Grade Buildings, (c) 2013 ASHRAE'
+        See `calculate_U_value_arrays` for processing whole arrays at once.
 
         Parameters
         ----------
@@ -416,128 +861,354 @@ class AmBIENCeDataset:
         pretext = " ".join(
             ["REFERENCE BUILDING", self.structure_types.loc[st, "mapping"]]
         )
-        material_resistance = (
-            r[" ".join([pretext, "MATERIAL THICKNESS (m)"])]
-            / r[" ".join([pretext, "MATERIAL THERMAL CONDUCTIVITY (W/m/K)"])]
-        )
-        insulation_resistance = (
-            r[" ".join([pretext, "INSULATION MATERIAL THICKNESS (m)"])]
-            / r[" ".join([pretext, "INSULATION MATERIAL THERMAL CONDUCTIVITY (W/m/K)"])]
-        )
-        # Internal structures assume no insulation.
-        if self.structure_types.loc[st, "is_internal"]:
-            intR = (
-                self.interior_node_depth * 0.5 * material_resistance
-                + self.structure_types.loc[st, "interior_resistance_m2K_W"]
-            )
-            extR = (
-                2 - self.interior_node_depth
-            ) * 0.5 * material_resistance + self.structure_types.loc[
-                st, "exterior_resistance_m2K_W"
-            ]
-            return (1.0 / extR, 0.0, 1.0 / intR, 1.0 / (extR + intR))
-        elif st == "base_floor":  # Base floor connects to the ground.
-            intR = (
-                self.interior_node_depth
-                * (material_resistance + 0.5 * insulation_resistance)
-                + self.structure_types.loc[st, "interior_resistance_m2K_W"]
-            )
-            flrR = (
-                material_resistance
-                + insulation_resistance
-                + self.structure_types.loc[st, "interior_resistance_m2K_W"]
-            )
-            grnR = 1.0 / (0.114 / (0.7044 + flrR) + 0.8768 / (2.818 + flrR))
-            grnR -= intR
-            return (0.0, 1.0 / grnR, 1.0 / intR, 1.0 / (intR + grnR))
-        else:  # Other structures connect to the ambient air.
-            intR = (
-                self.interior_node_depth
-                * (material_resistance + 0.5 * insulation_resistance)
-                + self.structure_types.loc[st, "interior_resistance_m2K_W"]
+        return tuple(
+            float(U)
+            for U in calculate_U_value_arrays(
+                r[" ".join([pretext, "MATERIAL THICKNESS (m)"])],
+                r[" ".join([pretext, "MATERIAL THERMAL CONDUCTIVITY (W/m/K)"])],
+                r[" ".join([pretext, "INSULATION MATERIAL THICKNESS (m)"])],
+                r[
+                    " ".join(
+                        [pretext, "INSULATION MATERIAL THERMAL CONDUCTIVITY (W/m/K)"]
+                    )
+                ],
+                self.structure_types.loc[st, "interior_resistance_m2K_W"],
+                self.structure_types.loc[st, "exterior_resistance_m2K_W"],
+                self.structure_types.loc[st, "is_internal"],
+                st == "base_floor",  # Base floor connects to the ground.
+                interior_node_depth=self.interior_node_depth,
             )
-            extR = (
-                material_resistance
-                + insulation_resistance
-                + self.structure_types.loc[st, "interior_resistance_m2K_W"]
-                + self.structure_types.loc[st, "exterior_resistance_m2K_W"]
-                - intR
+        )
+
+    def structure_property_array(self, prop):
+        """
+        Gather a property of the structures as a (reference building × structure type) array.
+
+        Parameters
+        ----------
+        prop : str
+            the property column suffix in the raw AmBIENCe data, e.g. 'MATERIAL THICKNESS (m)'.
+
+        Returns
+        -------
+        array
+            a float array with a row for each reference building and a column for each structure type.
+        """
+        cols = [
+            " ".join(["REFERENCE BUILDING", mapping, prop])
+            for mapping in self.structure_types["mapping"]
+        ]
+        return self.data[cols].to_numpy(dtype=float)
+
+    def calculate_structure_physics(
+        self, interior_node_depth=None, period_of_variations=None
+    ):
+        """
+        Calculate the U-values and effective thermal masses for every reference building and structure type.
+
+        The physics are only calculated once per unique combination of structure type and
+        material properties, as many reference buildings share the same structures.
+        The number of evaluations saved is recorded in `self.structure_physics_stats`.
+
+        Parameters
+        ----------
+        interior_node_depth : float or array
+            the interior node depth, `self.interior_node_depth` by default.
+            Arrays are broadcast against the unique structures, adding leading axes to the U-value arrays.
+        period_of_variations : float or array
+            the period of variations, `self.period_of_variations` by default.
+            Arrays are broadcast against the unique structures, adding leading axes to the effective thermal mass array.
+
+        Returns
+        -------
+        structure_physics
+            a dictionary of (reference building × structure type) arrays for the effective thermal mass
+            and the exterior, ground, interior, and total U-values.
+        """
+        if interior_node_depth is None:
+            interior_node_depth = self.interior_node_depth
+        if period_of_variations is None:
+            period_of_variations = self.period_of_variations
+        st = self.structure_types
+        num_rows, num_types = len(self.data), len(st)
+        props = [
+            "MATERIAL THICKNESS (m)",
+            "MATERIAL DENSITY (kg/m3)",
+            "MATERIAL SPECIFIC HEAT CAPACITY (J/kg/K)",
+            "MATERIAL THERMAL CONDUCTIVITY (W/m/K)",
+            "INSULATION MATERIAL THICKNESS (m)",
+            "INSULATION MATERIAL DENSITY (kg/m3)",
+            "INSULATION MATERIAL SPECIFIC HEAT CAPACITY (J/kg/K)",
+            "INSULATION MATERIAL THERMAL CONDUCTIVITY (W/m/K)",
+        ]
+        # Deduplicate (structure type, material properties) keys, the other inputs are shared.
+        keys = np.stack(
+            [np.broadcast_to(np.arange(num_types, dtype=float), (num_rows, num_types))]
+            + [self.structure_property_array(prop) for prop in props],
+            axis=-1,
+        ).reshape(-1, len(props) + 1)
+        unique_keys, inverse = np.unique(keys, axis=0, return_inverse=True)
+        self.structure_physics_stats = {
+            "evaluations": len(keys),
+            "unique_evaluations": len(unique_keys),
+            "hit_ratio": 1 - len(unique_keys) / len(keys) if len(keys) else 0.0,
+        }
+        # Calculate the physics for the unique keys only.
+        types = unique_keys[:, 0].astype(int)
+        (
+            thickness,
+            density,
+            specific_heat_capacity,
+            conductivity,
+            insulation_thickness,
+            insulation_density,
+            insulation_specific_heat_capacity,
+            insulation_conductivity,
+        ) = unique_keys[:, 1:].T
+        is_internal = st["is_internal"].to_numpy(dtype=bool)[types]
+        int_res = st["interior_resistance_m2K_W"].to_numpy(dtype=float)[types]
+        physics = {
+            "effective_thermal_mass_J_m2K": calculate_effective_thermal_mass_array(
+                thickness,
+                density,
+                specific_heat_capacity,
+                insulation_thickness,
+                insulation_density,
+                insulation_specific_heat_capacity,
+                int_res,
+                is_internal,
+                period_of_variations=period_of_variations,
             )
-            return (1.0 / extR, 0.0, 1.0 / intR, 1.0 / (extR + intR))
+        }
+        physics |= zip(
+            [
+                "external_U_value_to_ambient_air_W_m2K",
+                "external_U_value_to_ground_W_m2K",
+                "internal_U_value_to_structure_W_m2K",
+                "total_U_value_W_m2K",
+            ],
+            calculate_U_value_arrays(
+                thickness,
+                conductivity,
+                insulation_thickness,
+                insulation_conductivity,
+                int_res,
+                st["exterior_resistance_m2K_W"].to_numpy(dtype=float)[types],
+                is_internal,
+                (st.index == "base_floor")[types],  # Base floor connects to the ground.
+                interior_node_depth=interior_node_depth,
+            ),
+        )
+        # Broadcast the results back onto the full grid.
+        return {
+            key: val[..., inverse].reshape(val.shape[:-1] + (num_rows, num_types))
+            for key, val in physics.items()
+        }
+
+    def aggregate_structure_statistics(self, physics, grid={}, by=[]):
+        """
+        Aggregate structure physics into weighted structural statistics.
+
+        Parameters
+        ----------
+        physics : dict
+            the structure physics arrays from `calculate_structure_physics`.
+        grid : dict
+            the values of the parameters corresponding to the leading axes of the physics arrays, keyed by parameter name.
+        by : list
+            additional columns of the data to group by before the structure_statistics.csv index, e.g. 'scenario'.
+
+        Returns
+        -------
+        structural_statistics
+            a DataFrame indexed by the `grid` parameters and `by` columns, followed by the structure_statistics.csv index.
+        """
+        st = self.structure_types
+        num_rows, num_types = len(self.data), len(st)
+        shape = tuple(len(values) for values in grid.values()) + (num_rows, num_types)
+        num_combinations = int(np.prod(shape[:-2]))
+        # Weight the grid row-major, i.e. parameters first, then reference building, then structure type.
+        weight = self.data["material_combination_weight"].to_numpy(dtype=float)[:, None]
+        physics = dict(physics)
+        values = {
+            "design_U_value_W_m2K": self.structure_property_array("U-VALUE (W/m2/K)"),
+            "effective_thermal_mass_J_m2K": physics.pop("effective_thermal_mass_J_m2K"),
+            "linear_thermal_bridges_W_mK": st["linear_thermal_bridge_W_mK"].to_numpy(
+                dtype=float
+            ),
+        } | physics  # Followed by the U-values.
+        coords = np.meshgrid(*grid.values(), indexing="ij")
+        cols = by + ["building_type", "building_period", "location_id"]
+        rows = np.tile(np.repeat(np.arange(num_rows), num_types), num_combinations)
+        keys = (
+            {
+                name: np.repeat(coord.ravel(), num_rows * num_types)
+                for name, coord in zip(grid.keys(), coords)
+            }
+            | {col: self.data[col].array.take(rows) for col in cols}
+            | {
+                "structure_type": pd.Categorical(st.index).take(
+                    np.tile(np.arange(num_types), num_rows * num_combinations)
+                )
+            }
+        )
+        return weighted_sums(
+            keys,
+            {key: np.broadcast_to(val, shape).ravel() for key, val in values.items()},
+            np.broadcast_to(weight, shape).ravel(),
+        )
 
+    @memoize_statistics
     def calculate_structure_statistics(self):
         """
         Process structural statistics from data for ArchetypeBuildingModel.jl.
 
+        The whole (reference building × structure type) grid is calculated at once,
+        see `calculate_structure_physics`.
+
         Returns
         -------
         structural_statistics
             a DataFrame for structure_statistics.csv export.
         """
-        return (
-            pd.DataFrame(
-                [
-                    [
-                        r["building_type"],
-                        r["building_period"],
-                        r["location_id"],
-                        st,
-                        r["material_combination_weight"]
-                        * r[
-                            " ".join(
-                                [
-                                    "REFERENCE BUILDING",
-                                    self.structure_types.loc[st, "mapping"],
-                                    "U-VALUE (W/m2/K)",
-                                ]
-                            )
-                        ],
-                        r["material_combination_weight"]
-                        * self.calculate_weighted_effective_thermal_mass(
-                            r,
-                            st,
+        return self.aggregate_structure_statistics(self.calculate_structure_physics())
+
+    def sweep_structure_statistics(
+        self, interior_node_depths, periods_of_variations, max_workers=1
+    ):
+        """
+        Process structural statistics for every combination of interior node depth and period of variations.
+
+        The raw data is only processed once, and all combinations are calculated as a batch by
+        broadcasting the parameter grids against the unique structures, see `calculate_structure_physics`.
+        The interior node depths can be further split across worker processes,
+        with the dataset shared with each worker process once via the pool initializer, see `share_dataset`.
+        The sweep is calculated on a shallow copy, leaving the `self.structure_physics_stats` untouched.
+
+        Parameters
+        ----------
+        interior_node_depths : array
+            the interior node depths to sweep over.
+        periods_of_variations : array
+            the periods of variations in seconds to sweep over.
+        max_workers : int
+            maximum number of worker processes, `1` calculates the sweep in this process,
+            `None` uses the `ProcessPoolExecutor` default.
+
+        Returns
+        -------
+        structural_statistics
+            a DataFrame indexed by `interior_node_depth` and `period_of_variations`,
+            followed by the structure_statistics.csv index.
+        """
+        ind = np.unique(np.asarray(interior_node_depths, dtype=float))
+        pov = np.unique(np.asarray(periods_of_variations, dtype=float))
+        if max_workers != 1 and len(ind) > 1:
+            chunks = np.array_split(ind, min(max_workers or len(ind), len(ind)))
+            with ProcessPoolExecutor(
+                max_workers=max_workers, initializer=share_dataset, initargs=(self,)
+            ) as pool:
+                return pd.concat(
+                    pool.map(
+                        partial(
+                            sweep_shared_structure_statistics,
+                            periods_of_variations=pov,
                         ),
-                        r["material_combination_weight"]
-                        * self.structure_types.loc[st, "linear_thermal_bridge_W_mK"],
-                    ]
-                    + [
-                        r["material_combination_weight"] * x
-                        for x in self.calculate_U_values(r, st)
-                    ]
-                    for ((i, r), st) in product(
-                        self.data.iterrows(), self.structure_types.index
+                        chunks,
                     )
-                ],
-                columns=[
-                    "building_type",
-                    "building_period",
-                    "location_id",
-                    "structure_type",
-                    "design_U_value_W_m2K",
-                    "effective_thermal_mass_J_m2K",
-                    "linear_thermal_bridges_W_mK",
-                    "external_U_value_to_ambient_air_W_m2K",
-                    "external_U_value_to_ground_W_m2K",
-                    "internal_U_value_to_structure_W_m2K",
-                    "total_U_value_W_m2K",
-                ],
-            )
-            .groupby(
-                ["building_type", "building_period", "location_id", "structure_type"]
-            )
-            .agg(
-                {
-                    "design_U_value_W_m2K": "sum",
-                    "effective_thermal_mass_J_m2K": "sum",
-                    "linear_thermal_bridges_W_mK": "sum",
-                    "external_U_value_to_ambient_air_W_m2K": "sum",
-                    "external_U_value_to_ground_W_m2K": "sum",
-                    "internal_U_value_to_structure_W_m2K": "sum",
-                    "total_U_value_W_m2K": "sum",
-                }
+                )
+        sweep = copy.copy(self)
+        physics = sweep.calculate_structure_physics(
+            interior_node_depth=ind[:, None, None],
+            period_of_variations=pov[:, None],
+        )
+        return sweep.aggregate_structure_statistics(
+            physics, {"interior_node_depth": ind, "period_of_variations": pov}
+        )
+
+    def join_fenestration(self, by=[]):
+        """
+        Join the fenestration assumptions onto the reference buildings.
+
+        Fenestration properties are joined on the window glazing type and coating,
+        and combinations missing from the fenestration assumptions raise an error.
+
+        Parameters
+        ----------
+        by : list
+            additional columns of the data to include, e.g. 'scenario'.
+
+        Returns
+        -------
+        df
+            a DataFrame of the reference building keys, weights, and window properties.
+        """
+        cols = by + ["building_type", "building_period", "location_id"]
+        windows = list(self.fenestration.index.names)
+        df = pd.merge(  # Join fenestration properties on glazing type and coating.
+            self.data[
+                cols
+                + windows
+                + [
+                    "material_combination_weight",
+                    "REFERENCE BUILDING WINDOW U-VALUE (W/m2/K)",
+                ]
+            ],
+            self.fenestration[
+                ["normal_solar_energy_transmittance", "frame_area_fraction"]
+            ],
+            how="left",
+            left_on=windows,
+            right_index=True,
+            indicator=True,
+        )
+        unmatched = df[df["_merge"] == "left_only"]
+        if not unmatched.empty:
+            combinations = unmatched[windows].drop_duplicates()
+            raise ValueError(
+                f"{len(unmatched)} reference buildings have window glazing type and coating "
+                f"combinations {list(combinations.itertuples(index=False, name=None))} missing from the fenestration "
+                f"assumptions, e.g. {list(unmatched.index[:5])}"
             )
+        return df
+
+    def aggregate_ventilation_and_fenestration_statistics(self, by=[]):
+        """
+        Aggregate weighted ventilation and fenestration statistics.
+
+        See `join_fenestration` for how the fenestration properties are joined.
+
+        Parameters
+        ----------
+        by : list
+            additional columns of the data to group by before the ventilation_and_fenestration_statistics.csv index, e.g. 'scenario'.
+
+        Returns
+        -------
+        ventilation_and_fenestration_statistics
+            a DataFrame indexed by the `by` columns, followed by the ventilation_and_fenestration_statistics.csv index.
+        """
+        cols = by + ["building_type", "building_period", "location_id"]
+        df = self.join_fenestration(by)
+        weight = df["material_combination_weight"]
+        # Weighted here to keep the order of multiplications for the transmittance.
+        return weighted_sums(
+            {col: df[col] for col in cols},
+            {
+                "HRU_efficiency": weight * self.ventilation["HRU_efficiency"][0],
+                "infiltration_rate_1_h": weight
+                * self.ventilation["infiltration_rate_1_h"][0],
+                "total_normal_solar_energy_transmittance": weight
+                * df["normal_solar_energy_transmittance"]
+                * (1 - df["frame_area_fraction"]),
+                "ventilation_rate_1_h": weight
+                * self.ventilation["ventilation_rate_1_h"][0],
+                "window_U_value_W_m2K": weight
+                * df["REFERENCE BUILDING WINDOW U-VALUE (W/m2/K)"],
+            },
         )
 
+    @memoize_statistics
     def calculate_ventilation_and_fenestration_statistics(self):
         """
         Process ventilation and fenestration statistics for ArchetypeBuildingModel.jl.
@@ -547,135 +1218,563 @@ class AmBIENCeDataset:
         ventilation_and_fenestration_statistics
             a DataFrame for `ventilation_and_fenestration_statistics.csv` export.
         """
-        return (
-            pd.DataFrame(
-                [
-                    [
-                        r["building_type"],
-                        r["building_period"],
-                        r["location_id"],
-                        r["material_combination_weight"]
-                        * self.ventilation["HRU_efficiency"][0],
-                        r["material_combination_weight"]
-                        * self.ventilation["infiltration_rate_1_h"][0],
-                        r["material_combination_weight"]
-                        * self.fenestration.loc[
-                            (
-                                r["REFERENCE BUILDING WINDOW GLAZING TYPE"],
-                                r["REFERENCE BUILDING WINDOW COATED"],
-                            ),
-                            "normal_solar_energy_transmittance",
-                        ]
-                        * (
-                            1
-                            - self.fenestration.loc[
-                                (
-                                    r["REFERENCE BUILDING WINDOW GLAZING TYPE"],
-                                    r["REFERENCE BUILDING WINDOW COATED"],
-                                ),
-                                "frame_area_fraction",
-                            ]
-                        ),
-                        r["material_combination_weight"]
-                        * self.ventilation["ventilation_rate_1_h"][0],
-                        r["material_combination_weight"]
-                        * r["REFERENCE BUILDING WINDOW U-VALUE (W/m2/K)"],
-                    ]
-                    for (i, r) in self.data.iterrows()
+        return self.aggregate_ventilation_and_fenestration_statistics()
+
+    def sample_ventilation_and_fenestration_statistics(
+        self,
+        distributions,
+        samples=1000,
+        percentiles=[5, 50, 95],
+        seed=None,
+    ):
+        """
+        Monte Carlo sample ventilation and fenestration statistics under uncertain assumptions.
+
+        The statistics are linear in each sampled parameter, so the weighted means over the reference buildings
+        are only calculated once for each group, see `weighted_sums`, and the samples are evaluated
+        as (samples × group) arrays scaling them.
+        Parameters without a distribution keep their assumed values,
+        see `calculate_ventilation_and_fenestration_statistics` for the deterministic version.
+
+        Parameters
+        ----------
+        distributions : DataFrame
+            the distributions of the uncertain parameters, indexed by `parameter`, see `validate_distributions`.
+        samples : int
+            number of Monte Carlo samples.
+        percentiles : array
+            the percentiles of the statistics to return, between 0 and 100.
+        seed : int
+            seed for the random number generator, `None` for unpredictable samples.
+
+        Returns
+        -------
+        ventilation_and_fenestration_percentiles
+            a DataFrame of the percentiles of the ventilation and fenestration statistics,
+            indexed by `building_type`, `building_period`, `location_id`, and `percentile`.
+        """
+        unknown = set(distributions.index) - set(UNCERTAIN_PARAMETERS)
+        if unknown:
+            raise ValueError(
+                f"Unknown uncertain parameters {sorted(unknown)}, expected some of {UNCERTAIN_PARAMETERS}."
+            )
+        distributions = validate_distributions(distributions)
+        cols = ["building_type", "building_period", "location_id"]
+        df = self.join_fenestration()
+        sampled = sample_distributions(
+            distributions, samples, np.random.default_rng(seed)
+        )
+        # Each parameter is split into a coefficient for each reference building and a factor for each sample,
+        # with relative samples scaling the assumed values, and absolute samples replacing them.
+        coefficients, factors = {}, {}
+        for param in UNCERTAIN_PARAMETERS:
+            coefficients[param] = np.broadcast_to(
+                np.asarray(
+                    (
+                        self.ventilation[param][0]
+                        if param in self.ventilation.columns
+                        else df[param]
+                    ),
+                    dtype=float,
+                ),
+                len(df),
+            )
+            factors[param] = np.ones((samples, 1))
+            if param in sampled:
+                factors[param] = sampled[param][:, None]
+                if not distributions.loc[param, "relative"]:
+                    coefficients[param] = np.ones(len(df))
+        means = weighted_sums(
+            {col: df[col] for col in cols},
+            {
+                "HRU_efficiency": coefficients["HRU_efficiency"],
+                "infiltration_rate_1_h": coefficients["infiltration_rate_1_h"],
+                "normal_solar_energy_transmittance": coefficients[
+                    "normal_solar_energy_transmittance"
                 ],
-                columns=[
-                    "building_type",
-                    "building_period",
-                    "location_id",
-                    "HRU_efficiency",
-                    "infiltration_rate_1_h",
-                    "total_normal_solar_energy_transmittance",
-                    "ventilation_rate_1_h",
-                    "window_U_value_W_m2K",
+                "framed_solar_energy_transmittance": coefficients[
+                    "normal_solar_energy_transmittance"
+                ]
+                * coefficients["frame_area_fraction"],
+                "ventilation_rate_1_h": coefficients["ventilation_rate_1_h"],
+                "window_U_value_W_m2K": df[
+                    "REFERENCE BUILDING WINDOW U-VALUE (W/m2/K)"
                 ],
+            },
+            df["material_combination_weight"],
+        )
+        mean = {key: val.to_numpy() for key, val in means.items()}
+        # The (samples × group) arrays of the sampled statistics.
+        stats = {
+            "HRU_efficiency": factors["HRU_efficiency"] * mean["HRU_efficiency"],
+            "infiltration_rate_1_h": factors["infiltration_rate_1_h"]
+            * mean["infiltration_rate_1_h"],
+            "total_normal_solar_energy_transmittance": factors[
+                "normal_solar_energy_transmittance"
+            ]
+            * (
+                mean["normal_solar_energy_transmittance"]
+                - factors["frame_area_fraction"]
+                * mean["framed_solar_energy_transmittance"]
+            ),
+            "ventilation_rate_1_h": factors["ventilation_rate_1_h"]
+            * mean["ventilation_rate_1_h"],
+            "window_U_value_W_m2K": np.broadcast_to(
+                mean["window_U_value_W_m2K"], (samples, len(means))
+            ),
+        }
+        # Percentiles are calculated over all samples, resulting in (percentile × group) arrays.
+        return pd.DataFrame(
+            {
+                key: np.percentile(val, percentiles, axis=0).T.ravel()
+                for key, val in stats.items()
+            },
+            index=pd.MultiIndex.from_arrays(
+                [
+                    means.index.get_level_values(col).repeat(len(percentiles))
+                    for col in cols
+                ]
+                + [np.tile(percentiles, len(means))],
+                names=cols + ["percentile"],
+            ),
+        )
+
+    def apply_scenarios(self, modifications):
+        """
+        Apply declarative modifications to the structure and window properties of the reference buildings.
+
+        The modifications of each scenario are applied in order, with their conditions
+        evaluated on the unmodified data, e.g. to upgrade windows and their U-values together.
+        The design U-values of structures with modified material or insulation layers are shifted
+        by the change in the thermal resistance of the layers, unless the scenario modifies them as well.
+
+        Parameters
+        ----------
+        modifications : DataFrame
+            the modifications with a row for each `scenario` and raw AmBIENCe `column` to modify,
+            e.g. 'REFERENCE BUILDING WALL INSULATION MATERIAL THICKNESS (m)', see `reader.STRUCTURE_PROPERTIES` and `reader.WINDOW_COLUMNS`.
+            The `operation` is either 'add' the `value` to the column, treating missing values as zero,
+            or 'set' the column to the `value`, applied only to the reference buildings matching
+            the optional `DataFrame.query` `condition`, e.g. '`REFERENCE BUILDING CONSTRUCTION YEAR HIGH` < 1970'.
+
+        Returns
+        -------
+        data
+            the unmodified 'baseline' and the modified data of every scenario stacked, with the `scenario` column first.
+        """
+        mappings = list(dict.fromkeys(self.structure_types["mapping"]))
+        columns = WINDOW_COLUMNS + [
+            " ".join(["REFERENCE BUILDING", mapping, prop])
+            for mapping in mappings
+            for prop in STRUCTURE_PROPERTIES
+        ]
+        unknown = set(modifications["column"]) - set(columns)
+        if unknown:
+            raise ValueError(
+                f"Unable to modify columns {sorted(unknown)}, expected some of {columns}."
             )
-            .groupby(["building_type", "building_period", "location_id"])
-            .agg(
-                {
-                    "HRU_efficiency": "sum",
-                    "infiltration_rate_1_h": "sum",
-                    "total_normal_solar_energy_transmittance": "sum",
-                    "ventilation_rate_1_h": "sum",
-                    "window_U_value_W_m2K": "sum",
-                }
+        if "baseline" in set(modifications["scenario"]):
+            raise ValueError(
+                "The `baseline` scenario is reserved for the unmodified data."
             )
+        frames = {"baseline": self.data}
+        for scenario, mods in modifications.groupby("scenario", sort=False):
+            data = self.data.copy()
+            for mod in mods.itertuples():
+                mask = (
+                    self.data.eval(mod.condition).to_numpy(dtype=bool)
+                    if isinstance(mod.condition, str) and mod.condition.strip()
+                    else np.ones(len(self.data), dtype=bool)
+                )
+                if mod.operation == "add":
+                    # Missing values are treated as zero, e.g. to add insulation to uninsulated structures.
+                    targeted = data.loc[mask, mod.column]
+                    data.loc[mask, mod.column] = targeted.fillna(0) + float(mod.value)
+                elif mod.operation == "set":
+                    data.loc[mask, mod.column] = pd.Series(
+                        [mod.value], dtype=object
+                    ).astype(self.data[mod.column].dtype)[0]
+                else:
+                    raise ValueError(
+                        f"Unknown operation `{mod.operation}` in scenario `{scenario}`, expected 'add' or 'set'."
+                    )
+            for mapping in mappings:
+                design_U = f"REFERENCE BUILDING {mapping} U-VALUE (W/m2/K)"
+                if design_U not in set(mods["column"]):
+                    data[design_U] = self.shift_design_U_values(data, mapping)
+            frames[scenario] = data
+        return pd.concat(frames, names=["scenario"]).reset_index("scenario")
+
+    def shift_design_U_values(self, data, mapping):
+        """
+        Shift the design U-values of a structure by the change in the thermal resistance of its layers.
+
+        The thermal resistance of the material and insulation layers is their thickness divided by their
+        thermal conductivity, and the change in it is added to the resistance of the unmodified design U-values.
+        Layers without a thickness, e.g. missing insulation, have no thermal resistance.
+
+        Parameters
+        ----------
+        data : DataFrame
+            the modified data, with the same rows as `self.data`.
+        mapping : str
+            the structure in the raw AmBIENCe data, e.g. 'WALL', see `structure_types.csv`.
+
+        Returns
+        -------
+        design_U_values
+            a Series of the design U-values of the structure, unchanged for reference buildings with unmodified layers.
+        """
+        layers = [
+            [
+                f"REFERENCE BUILDING {mapping} {layer}MATERIAL THICKNESS (m)",
+                f"REFERENCE BUILDING {mapping} {layer}MATERIAL THERMAL CONDUCTIVITY (W/m/K)",
+            ]
+            for layer in ["", "INSULATION "]
+        ]
+        design_U = self.data[f"REFERENCE BUILDING {mapping} U-VALUE (W/m2/K)"]
+        old, new = self.data[sum(layers, [])], data[sum(layers, [])]
+        modified = (old.ne(new) & ~(old.isna() & new.isna())).any(axis=1).to_numpy()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            resistance = {
+                name: sum(
+                    np.where(
+                        df[thickness].fillna(0).to_numpy(dtype=float) > 0,
+                        df[thickness].to_numpy(dtype=float)
+                        / df[conductivity].to_numpy(dtype=float),
+                        0.0,
+                    )
+                    for thickness, conductivity in layers
+                )
+                for name, df in {"old": old, "new": new}.items()
+            }
+            shifted = 1 / (
+                1 / design_U.to_numpy(dtype=float)
+                + resistance["new"]
+                - resistance["old"]
+            )
+        return design_U.where(~modified, shifted)
+
+    def calculate_scenario_statistics(self, modifications):
+        """
+        Process structure and ventilation and fenestration statistics for renovation scenarios.
+
+        All scenarios are calculated in one batch over the stacked scenario data, see `apply_scenarios`,
+        so the physics of structures unchanged between scenarios are only calculated once, see `calculate_structure_physics`.
+        The number of evaluations saved is recorded in `self.scenario_physics_stats`,
+        leaving the `self.structure_physics_stats` of the baseline untouched.
+
+        Parameters
+        ----------
+        modifications : DataFrame
+            the modifications defining the scenarios, see `apply_scenarios`.
+
+        Returns
+        -------
+        structural_statistics
+            a DataFrame indexed by `scenario`, followed by the structure_statistics.csv index.
+        ventilation_and_fenestration_statistics
+            a DataFrame indexed by `scenario`, followed by the ventilation_and_fenestration_statistics.csv index.
+        """
+        # Shallow copy sharing the assumptions, with the stacked scenario data instead of the original,
+        # and its own memoized statistics and physics stats, so that the scenarios don't leak into the baseline.
+        scenarios = copy.copy(self)
+        scenarios.data = self.apply_scenarios(modifications)
+        scenarios.statistics_cache = {}
+        scenarios.statistics_cache_stats = {"hits": 0, "misses": 0}
+        structure_statistics = scenarios.aggregate_structure_statistics(
+            scenarios.calculate_structure_physics(), by=["scenario"]
+        )
+        self.scenario_physics_stats = scenarios.structure_physics_stats
+        return (
+            structure_statistics,
+            scenarios.aggregate_ventilation_and_fenestration_statistics(
+                by=["scenario"]
+            ),
         )
 
 
 class ABMDataset:
     """An object class for containing and exporting ArchetypeBuildingModel.jl compatible data."""
 
+    # Tables exported as .csv files, computed lazily on first access.
+    tables = [
+        "building_period",
+        "building_stock",
+        "structure_type",
+        "building_stock_statistics",
+        "structure_statistics",
+        "ventilation_and_fenestration_statistics",
+        "location_id",
+    ]
+    # Tables kept in their existing order instead of sorting by index.
+    unsorted_tables = []
+    # Tables that can be computed and exported one country at a time, see `table_chunks`.
+    streamed_tables = [
+        "building_stock",
+        "building_stock_statistics",
+        "structure_statistics",
+        "ventilation_and_fenestration_statistics",
+    ]
+    # Inputs of each table, see `AmBIENCeDataset.input_digests`.
+    table_inputs = {
+        "building_period": AMBIENCE_INPUTS,
+        "building_stock": AMBIENCE_INPUTS,
+        "structure_type": ["structure_types"],
+        "building_stock_statistics": AMBIENCE_INPUTS,
+        "structure_statistics": AMBIENCE_INPUTS
+        + ["structure_types", "interior_node_depth", "period_of_variations"],
+        "ventilation_and_fenestration_statistics": AMBIENCE_INPUTS
+        + ["fenestration", "ventilation"],
+        "location_id": AMBIENCE_INPUTS,
+    }
+
     def __init__(self, ambdata):
         """
         Process the AmBIENCe project raw data for ArchetypeBuildingModel.jl.
 
+        The tables are computed lazily on first access and cached,
+        call `invalidate` if `ambdata` is modified afterwards, e.g. via `extrapolate`.
+
         Parameters
         ----------
         ambdata : AmBIENCeDataset
             the pre-processed AmBIENCe dataset used as the basis for the ABM.jl data.
         """
-        self.building_period = ambdata.building_periods()
-        self.building_stock = ambdata.building_stocks()
-        self.structure_type = ambdata.structure_types.drop(columns=["mapping"])
-        self.building_stock_statistics = ambdata.calculate_building_stock_statistics()
-        self.structure_statistics = ambdata.calculate_structure_statistics()
-        self.ventilation_and_fenestration_statistics = (
-            ambdata.calculate_ventilation_and_fenestration_statistics()
-        )
-        self.location_id = (
-            ambdata.data[["location_id"]].drop_duplicates().set_index("location_id")
-        )
+        self.ambdata = ambdata
         self.shapefile_mappings = ambdata.shapefile_mappings
         self.building_type_mappings = ambdata.building_type_mappings
 
-    def export_csvs(self, folderpath="data/"):
+    @cached_property
+    def building_period(self):
+        """Unique building periods, see `AmBIENCeDataset.building_periods`."""
+        return self.ambdata.building_periods()
+
+    @cached_property
+    def building_stock(self):
+        """Building stocks, see `AmBIENCeDataset.building_stocks`."""
+        return self.ambdata.building_stocks()
+
+    @cached_property
+    def structure_type(self):
+        """Structure type properties without the AmBIENCe mappings."""
+        return self.ambdata.structure_types.drop(columns=["mapping"])
+
+    @cached_property
+    def building_stock_statistics(self):
+        """Building stock statistics, see `AmBIENCeDataset.calculate_building_stock_statistics`."""
+        return self.ambdata.calculate_building_stock_statistics()
+
+    @cached_property
+    def structure_statistics(self):
+        """Structure statistics, see `AmBIENCeDataset.calculate_structure_statistics`."""
+        return self.ambdata.calculate_structure_statistics()
+
+    @cached_property
+    def ventilation_and_fenestration_statistics(self):
+        """Ventilation and fenestration statistics, see `AmBIENCeDataset.calculate_ventilation_and_fenestration_statistics`."""
+        return self.ambdata.calculate_ventilation_and_fenestration_statistics()
+
+    @cached_property
+    def location_id(self):
+        """Unique location ids in the data."""
+        return (
+            self.ambdata.data[["location_id"]]
+            .drop_duplicates()
+            .set_index("location_id")
+        )
+
+    def invalidate(self, tables=None):
+        """
+        Discard cached tables so that they are recomputed on next access.
+
+        Parameters
+        ----------
+        tables : list
+            names of the tables to invalidate, all tables by default.
+        """
+        for table in self.tables if tables is None else tables:
+            self.__dict__.pop(table, None)
+
+    def get_table(self, table):
+        """
+        Get an exported table by name.
+
+        Parameters
+        ----------
+        table : str
+            name of the table, see `ABMDataset.tables`.
+
+        Returns
+        -------
+        df : DataFrame
+            the requested table.
+        """
+        return getattr(self, table)
+
+    def table_chunks(self, table, chunk_rows=None):
         """
-        Export the ABMDataset contents as .csv files.
+        Compute a table one country at a time, see `AmBIENCeDataset.country_shard`.
+
+        Optionally, the countries are grouped in order into chunks of at most `chunk_rows` rows of AmBIENCe data,
+        or a single country if it has more, to amortize the per-chunk overhead of the calculations for small countries.
+
+        Parameters
+        ----------
+        table : str
+            name of the table, see `ABMDataset.streamed_tables`.
+        chunk_rows : int
+            maximum number of rows of AmBIENCe data per chunk, `None` for a single country per chunk.
+
+        Returns
+        -------
+        chunks : generator
+            the table for each country or group of countries, computed lazily so that only one is held in memory at a time.
+        """
+        rows = self.ambdata.data["location_id"].value_counts().sort_index()
+        rows = rows[rows > 0]  # Categories of countries without data.
+        chunk, total = [], 0
+        for location_id, count in rows.items():
+            if chunk and (chunk_rows is None or total + count > chunk_rows):
+                yield ABMDataset(self.ambdata.country_shard(*chunk)).get_table(table)
+                chunk, total = [], 0
+            chunk.append(location_id)
+            total += count
+        if chunk:
+            yield ABMDataset(self.ambdata.country_shard(*chunk)).get_table(table)
+
+    def table_dependencies(self):
+        """
+        Collect the content hashes of the inputs of each table, see `ABMDataset.table_inputs`.
+
+        Returns
+        -------
+        dependencies : dict
+            the content hashes of the inputs of each table, keyed by table and input name.
+        """
+        digests = self.ambdata.input_digests()
+        return {
+            table: {name: digests[name] for name in inputs}
+            for table, inputs in self.table_inputs.items()
+        }
+
+    def export_csvs(
+        self,
+        folderpath="data/",
+        tables=None,
+        max_workers=None,
+        format="csv",
+        streaming=False,
+        chunk_rows=None,
+    ):
+        """
+        Export the ABMDataset contents as .csv, .parquet or .arrow files.
+
+        Only the exported tables are computed, after which they are sorted and written concurrently.
+        Each file is written atomically via a temporary file, see `export.export_tables`.
+        When streaming, the `streamed_tables` are instead computed and written one country at a time,
+        see `export.export_table_chunks` and `table_chunks`.
 
         Parameters
         ----------
         folderpath : str
             the folder path where to export the contents.
+        tables : list
+            names of the tables to export, all tables by default.
+        max_workers : int
+            maximum number of threads for sorting and writing the tables.
+        format : str
+            the file format, 'csv' by default, or 'parquet' or 'arrow' for typed columns
+            with dictionary-encoded index columns.
+        streaming : bool
+            Flag to bound memory use by exporting the `streamed_tables` one country at a time, only for 'csv'.
+        chunk_rows : int
+            maximum number of rows of AmBIENCe data per streamed chunk, `None` for a single country per chunk.
 
         Returns
         -------
-        a bunch of .csv files as output, but the function returns nothing.
+        report : DataFrame
+            the size in bytes and write time in seconds for each exported file.
         """
-        self.building_period.sort_index().to_csv(folderpath + "building_period.csv")
-        self.building_stock.sort_index().to_csv(folderpath + "building_stock.csv")
-        self.structure_type.sort_index().to_csv(folderpath + "structure_type.csv")
-        self.building_stock_statistics.sort_index().to_csv(
-            folderpath + "building_stock_statistics.csv"
-        )
-        self.structure_statistics.sort_index().to_csv(
-            folderpath + "structure_statistics.csv"
+        tables = self.tables if tables is None else tables
+        streamed = [
+            table for table in tables if streaming and table in self.streamed_tables
+        ]
+        return export_tables(
+            {table: getattr(self, table) for table in tables if table not in streamed},
+            folderpath,
+            unsorted_tables=self.unsorted_tables,
+            max_workers=max_workers,
+            format=format,
+            chunked_tables={
+                table: self.table_chunks(table, chunk_rows) for table in streamed
+            },
         )
-        self.ventilation_and_fenestration_statistics.sort_index().to_csv(
-            folderpath + "ventilation_and_fenestration_statistics.csv"
+
+    def map_spine_data(self, specification_path="import_ambience2abm_data.json"):
+        """
+        Map the ABMDataset contents into Spine database items without exporting them.
+
+        Follows the Spine Toolbox importer specification, see `spine_db.map_tables`.
+
+        Parameters
+        ----------
+        specification_path : str
+            path to the Spine Toolbox importer specification.
+
+        Returns
+        -------
+        mapped_data : dict
+            the mapped items as keyword arguments for `spinedb_api.import_data`.
+        """
+        return map_tables(
+            {table: getattr(self, table) for table in self.tables},
+            specification_path,
         )
-        self.location_id.sort_index().to_csv(folderpath + "location_id.csv")
 
-    def create_datapackage(self, folderpath="data/"):
+    def export_spine_db(self, url, specification_path="import_ambience2abm_data.json"):
         """
-        Create and infer a DataPackage from exported .csv files.
+        Import the ABMDataset contents directly into a Spine database.
+
+        Parameters
+        ----------
+        url : str
+            the Spine database URL, or a path to a local SQLite database file.
+        specification_path : str
+            path to the Spine Toolbox importer specification.
+
+        Returns
+        -------
+        count : int
+            the number of imported items.
+        """
+        return import_mapped_data(url, self.map_spine_data(specification_path))
+
+    def create_datapackage(self, folderpath="data/", format="csv", schemas=None):
+        """
+        Create a DataPackage for the exported files.
+
+        The resource schemas are built from the in-memory tables, see `datapackage.create_package`.
 
         Parameters
         ----------
         folderpath : str
             the folder path of the DataPackage contents.
+        format : str
+            the file format of the exported contents, 'csv' by default.
+        schemas : dict
+            previously built Table Schemas of the tables, `None` builds them from the tables.
 
         Returns
         -------
         pkg
             a Package object with contents and metadata.
         """
-        pkg = Package(folderpath + "*.csv")
-        pkg.infer()
+        if schemas is None:
+            schemas = {
+                table: table_schema(self.get_table(table)) for table in self.tables
+            }
+        pkg = create_package(schemas, folderpath, format=format)
         pkg.name = "ambience2abm_data"
         pkg.licenses = [
             {
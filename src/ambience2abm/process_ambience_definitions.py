@@ -5,13 +5,70 @@
 import pandas as pd
 import numpy as np
 from . import __version__
-from frictionless import Package
+from .datapackage import create_package, table_schema
+from .export import export_tables
+from .spine_db import import_mapped_data, map_tables
+from .reader import GEOMETRY_COLUMNS
+from .aggregation import normalize_weights, weighted_sums
+from .cache import hash_inputs
+from .identifiers import concatenate_labels
+from .process_ambience_data import AMBIENCE_INPUTS
 from datetime import datetime
 
 
 class ABMDefinitions:
     """An object class for processing and containing AmBIENCe archetype building definitions."""
 
+    # Tables exported as .csv files, either methods or attributes.
+    tables = [
+        "building_archetype",
+        "building_scope",
+        "building_scope__building_type",
+        "building_scope__heat_source",
+        "building_scope__location_id",
+        "building_fabrics",
+        "building_node__structure_type",
+        "building_loads",
+        "building_archetype__building_loads",
+    ]
+    # Tables kept in their existing order instead of sorting by index.
+    unsorted_tables = ["building_loads", "building_archetype__building_loads"]
+    # Tables that can be computed and exported in chunks, none for the definitions.
+    streamed_tables = []
+    # Inputs of each table, see `ABMDefinitions.input_digests`.
+    table_inputs = {
+        "building_archetype": AMBIENCE_INPUTS
+        + [
+            "aggregate_building_type",
+            "aggregate_building_period",
+            "countries",
+            "building_fabrics",
+            "room_height_m",
+            "weather_start",
+            "weather_end",
+            "partition_wall_length_ratio_to_external_walls_m_m",
+            "window_area_thermal_bridge_surcharge_W_m2K",
+        ],
+        "building_scope": AMBIENCE_INPUTS
+        + ["aggregate_building_type", "aggregate_building_period"],
+        "building_scope__building_type": AMBIENCE_INPUTS
+        + ["aggregate_building_type", "aggregate_building_period"],
+        "building_scope__heat_source": AMBIENCE_INPUTS
+        + ["aggregate_building_type", "aggregate_building_period"],
+        "building_scope__location_id": AMBIENCE_INPUTS
+        + ["aggregate_building_type", "aggregate_building_period"],
+        "building_fabrics": ["building_fabrics"],
+        "building_node__structure_type": ["building_nodes"],
+        "building_loads": ["countries", "loads"],
+        "building_archetype__building_loads": AMBIENCE_INPUTS
+        + [
+            "aggregate_building_type",
+            "aggregate_building_period",
+            "countries",
+            "loads",
+        ],
+    }
+
     def __init__(
         self,
         ambience,
@@ -67,6 +124,15 @@ class ABMDefinitions:
         self.window_area_thermal_bridge_surcharge_W_m2K = (
             window_area_thermal_bridge_surcharge_W_m2K
         )
+        self.aggregate_building_type = aggregate_building_type
+        self.aggregate_building_period = aggregate_building_period
+        # Input files are recorded for incremental updates, see `input_digests`.
+        self.input_paths = {
+            "building_fabrics": building_fabrics_path,
+            "building_nodes": building_nodes_path,
+            "countries": countries_path,
+            "loads": loads_path,
+        }
         self.building_fabrics = pd.read_csv(building_fabrics_path).set_index(
             "building_node"
         )
@@ -110,11 +176,11 @@ class ABMDefinitions:
             "number_of_buildings": "number_of_buildings",
             "average_gross_floor_area_m2_per_building": "average_gross_floor_area_m2_per_building",
             "category": "category",
-            "NUMBER OF REFERENCE BUILDING STOREYS": "number_of_storeys",
-            "REFERENCE BUILDING GROUND FLOOR AREA (m2)": "reference_floor_area_m2",
-            "REFERENCE BUILDING WALL AREA (m2)": "reference_wall_area_m2",
-            "REFERENCE BUILDING WINDOW AREA (m2)": "reference_window_area_m2",
-            "REFERENCE BUILDING ROOF AREA (m2)": "reference_roof_area_m2",
+        }
+        cols |= (
+            GEOMETRY_COLUMNS  # Geometry columns shared with `reader.required_columns`.
+        )
+        cols |= {
             "HEATING SYSTEM 1 HEAT SOURCE": "heat_source_1",
             "HEATING SYSTEM 2 HEAT SOURCE": "heat_source_2",
             "HEATING SYSTEM 3 HEAT SOURCE": "heat_source_3",
@@ -124,7 +190,7 @@ class ABMDefinitions:
         df = self.ambience.data[cols.keys()].reset_index()
         df = df.rename(columns=cols)
         # Calculate max and min period years
-        agg_df = df.groupby(["location_id"]).agg(
+        agg_df = df.groupby(["location_id"], observed=True, sort=True).agg(
             min_period_year=("period_low", "min"),
             max_period_year=("period_high", "max"),
         )
@@ -142,31 +208,30 @@ class ABMDefinitions:
             df["scope_period_start_year"] = df["period_low"]
             df["scope_period_end_year"] = df["period_high"]
         # Form `building_scope` names
-        df["building_scope"] = (
-            df["location_id"]
-            + "_"
-            + df["scope_types"]
-            + "_"
-            + df["scope_period_start_year"].apply(str)
-            + "_"
-            + df["scope_period_end_year"].apply(str)
+        df["building_scope"] = concatenate_labels(
+            df["location_id"],
+            "_",
+            df["scope_types"],
+            "_",
+            df["scope_period_start_year"],
+            "_",
+            df["scope_period_end_year"],
         )
         # Calculate reference building weights by `building_scope`
         df["total_gross_floor_area_m2"] = (
             df["number_of_buildings"] * df["average_gross_floor_area_m2_per_building"]
         )
-        agg_df = df.groupby(["building_scope"]).agg(
-            total_gross_floor_area_m2_per_scope=("total_gross_floor_area_m2", "sum")
-        )
-        df = df.join(agg_df, on="building_scope")
-        df["weight_within_scope"] = (
-            df["total_gross_floor_area_m2"] / df["total_gross_floor_area_m2_per_scope"]
+        (
+            df["total_gross_floor_area_m2_per_scope"],
+            df["weight_within_scope"],
+        ) = normalize_weights(
+            {"building_scope": df["building_scope"]}, df["total_gross_floor_area_m2"]
         )
         # Join timezones and load mappings
         df = df.join(self.loads_mapping, on="location_id")
         # Form `building_loads` id
-        df["building_loads"] = (
-            df["loads"] + "_" + df["category"] + "_UTC+" + df["timezone"].apply(str)
+        df["building_loads"] = concatenate_labels(
+            df["loads"], "_", df["category"], "_UTC+", df["timezone"]
         )
         return df
 
@@ -193,8 +258,8 @@ class ABMDefinitions:
             + (df["hour"] + 1).apply(str).str.zfill(2)
         )
         # Form `building_loads` id
-        df["building_loads"] = (
-            df["loads"] + "_" + df["category"] + "_UTC+" + df["timezone"].apply(str)
+        df["building_loads"] = concatenate_labels(
+            df["loads"], "_", df["category"], "_UTC+", df["timezone"]
         )
         # Reorganize
         df = (
@@ -348,23 +413,19 @@ class ABMDefinitions:
         df : DataFrame
             Preprocessed definitions related data.
         """
-        df = self.data.copy()
-        # Add `building_fabrics`.
-        df["building_fabrics"] = self.building_fabrics["building_fabrics"].unique()[0]
-        # Add assumed archetype parameters
-        df["weather_start"] = self.weather_start
-        df["weather_end"] = self.weather_end
-        df["partition_wall_length_ratio_to_external_walls_m_m"] = (
-            self.partition_wall_length_ratio_to_external_walls_m_m
-        )
-        df["window_area_thermal_bridge_surcharge_W_m2K"] = (
-            self.window_area_thermal_bridge_surcharge_W_m2K
-        )
-        df["room_height_m"] = self.room_height_m
+        # Only the columns needed for the weighted archetype geometry are copied.
+        cols = [
+            "number_of_storeys",
+            "reference_floor_area_m2",
+            "reference_wall_area_m2",
+            "reference_window_area_m2",
+            "reference_roof_area_m2",
+        ]
+        df = self.data[["building_scope", "weight_within_scope", *cols]].copy()
         # Calculate archetype building properties of interest
         df = self.calculate_building_frame_depth(df)
         df = self.calculate_window_area_to_external_wall_ratio_m2_m2(df)
-        # Prep weighted properties within scope.
+        # Aggregate the weighted properties within scope over `building_archetype`.
         cols = [
             "building_frame_depth_m",
             "number_of_storeys",
@@ -374,24 +435,39 @@ class ABMDefinitions:
             "reference_window_area_m2",
             "reference_roof_area_m2",
         ]
-        weighted_df = (
-            df[cols]
-            .apply(lambda col: col * df["weight_within_scope"])
-            .rename(columns={col: "weighted_" + col for col in cols})
-        )
-        df = df.join(weighted_df)
-        # Add `building_archetype` dimension and aggregate over it.
-        df["building_archetype"] = df["building_scope"]
-        agg_df = df.groupby(["building_archetype"]).agg(
-            {"weighted_" + col: ["sum"] for col in cols}
+        agg_df = weighted_sums(
+            {"building_archetype": df["building_scope"]},
+            {col: df[col] for col in cols},
+            df["weight_within_scope"],
         )
-        agg_df = agg_df.droplevel(1, axis=1).rename(
-            columns={"weighted_" + col: col for col in cols}
-        )
-        df = df.set_index("building_archetype")
-        agg_df = agg_df.join(df, rsuffix="_old")
         # Round `number_of_storeys` to the nearest 0.5 to avoid excessive partial storeys.
         agg_df["number_of_storeys"] = round(agg_df["number_of_storeys"] * 2) / 2
+        # Unique grids and nodes of each archetype, in the order of their first rows.
+        nodes = (
+            self.data[["building_scope", "grid_name", "node_name"]]
+            .drop_duplicates()
+            .dropna(subset="building_scope")
+            .sort_values("building_scope", kind="stable")
+        )
+        agg_df = agg_df.reindex(nodes["building_scope"].array)
+        agg_df.index.name = "building_archetype"
+        # Add the constant `building_fabrics` and assumed archetype parameters.
+        constants = {
+            "building_scope": nodes["building_scope"].array,
+            "building_fabrics": self.building_fabrics["building_fabrics"].unique()[0],
+            "weather_start": self.weather_start,
+            "weather_end": self.weather_end,
+            "room_height_m": self.room_height_m,
+            "partition_wall_length_ratio_to_external_walls_m_m": (
+                self.partition_wall_length_ratio_to_external_walls_m_m
+            ),
+            "window_area_thermal_bridge_surcharge_W_m2K": (
+                self.window_area_thermal_bridge_surcharge_W_m2K
+            ),
+            "grid_name": nodes["grid_name"].array,
+            "node_name": nodes["node_name"].array,
+        }
+        agg_df = agg_df.assign(**constants)
         # Reorder columns and return
         return agg_df[
             [
@@ -412,7 +488,7 @@ class ABMDefinitions:
                 "grid_name",
                 "node_name",
             ]
-        ].drop_duplicates()
+        ]
 
     def building_loads(self):
         """
@@ -458,57 +534,169 @@ class ABMDefinitions:
         )
         return df[df.index.notnull()]
 
-    def export_csvs(self, folderpath="definitions/"):
+    def get_table(self, table):
+        """
+        Get an exported table by name.
+
+        Parameters
+        ----------
+        table : str
+            name of the table, see `ABMDefinitions.tables`.
+
+        Returns
+        -------
+        df : DataFrame
+            the requested table.
+        """
+        attr = getattr(self, table)
+        return attr() if callable(attr) else attr
+
+    def input_digests(self):
+        """
+        Calculate content hashes of the input files and parameters of the definitions.
+
+        Returns
+        -------
+        digests : dict
+            the content hash of each input file in `input_paths` and each parameter, keyed by name,
+            including the inputs of the underlying AmBIENCeDataset.
+        """
+        return (
+            self.ambience.input_digests()
+            | {name: hash_inputs([path]) for name, path in self.input_paths.items()}
+            | {
+                name: hash_inputs([], getattr(self, name))
+                for name in [
+                    "aggregate_building_type",
+                    "aggregate_building_period",
+                    "room_height_m",
+                    "weather_start",
+                    "weather_end",
+                    "partition_wall_length_ratio_to_external_walls_m_m",
+                    "window_area_thermal_bridge_surcharge_W_m2K",
+                ]
+            }
+        )
+
+    def table_dependencies(self):
+        """
+        Collect the content hashes of the inputs of each table, see `ABMDefinitions.table_inputs`.
+
+        Returns
+        -------
+        dependencies : dict
+            the content hashes of the inputs of each table, keyed by table and input name.
+        """
+        digests = self.input_digests()
+        return {
+            table: {name: digests[name] for name in inputs}
+            for table, inputs in self.table_inputs.items()
+        }
+
+    def export_csvs(
+        self, folderpath="definitions/", tables=None, max_workers=None, format="csv"
+    ):
         """
-        Sort and export the ABMDefinitions contents as .csv files.
+        Sort and export the ABMDefinitions contents as .csv, .parquet or .arrow files.
+
+        The tables are sorted and written concurrently, each file atomically via a temporary file,
+        see `export.export_tables`.
 
         Parameters
         ----------
         folderpath : str
             the folder path where to export the contents.
+        tables : list
+            names of the tables to export, all tables by default.
+        max_workers : int
+            maximum number of threads for sorting and writing the tables.
+        format : str
+            the file format, 'csv' by default, or 'parquet' or 'arrow' for typed columns
+            with dictionary-encoded index columns.
 
         Returns
         -------
-        a bunch of .csv files as output, but the function returns nothing.
+        report : DataFrame
+            the size in bytes and write time in seconds for each exported file.
         """
-        self.building_archetype().sort_index().to_csv(
-            folderpath + "building_archetype.csv"
-        )
-        self.building_scope().sort_index().to_csv(folderpath + "building_scope.csv")
-        self.building_scope__building_type().sort_index().to_csv(
-            folderpath + "building_scope__building_type.csv"
-        )
-        self.building_scope__heat_source().sort_index().to_csv(
-            folderpath + "building_scope__heat_source.csv"
-        )
-        self.building_scope__location_id().sort_index().to_csv(
-            folderpath + "building_scope__location_id.csv"
-        )
-        self.building_fabrics.sort_index().to_csv(folderpath + "building_fabrics.csv")
-        self.building_node__structure_type.sort_index().to_csv(
-            folderpath + "building_node__structure_type.csv"
+        return export_tables(
+            {
+                table: self.get_table(table)
+                for table in (self.tables if tables is None else tables)
+            },
+            folderpath,
+            unsorted_tables=self.unsorted_tables,
+            max_workers=max_workers,
+            format=format,
         )
-        self.building_loads().to_csv(folderpath + "building_loads.csv")
-        self.building_archetype__building_loads().to_csv(
-            folderpath + "building_archetype__building_loads.csv"
+
+    def map_spine_data(self, specification_path="import_ambience2abm_definitions.json"):
+        """
+        Map the ABMDefinitions contents into Spine database items without exporting them.
+
+        Follows the Spine Toolbox importer specification, see `spine_db.map_tables`.
+
+        Parameters
+        ----------
+        specification_path : str
+            path to the Spine Toolbox importer specification.
+
+        Returns
+        -------
+        mapped_data : dict
+            the mapped items as keyword arguments for `spinedb_api.import_data`.
+        """
+        return map_tables(
+            {table: self.get_table(table) for table in self.tables},
+            specification_path,
+            unsorted_tables=self.unsorted_tables,
         )
 
-    def create_datapackage(self, folderpath="definitions/"):
+    def export_spine_db(
+        self, url, specification_path="import_ambience2abm_definitions.json"
+    ):
         """
-        Create and infer a DataPackage from exported .csv files.
+        Import the ABMDefinitions contents directly into a Spine database.
+
+        Parameters
+        ----------
+        url : str
+            the Spine database URL, or a path to a local SQLite database file.
+        specification_path : str
+            path to the Spine Toolbox importer specification.
+
+        Returns
+        -------
+        count : int
+            the number of imported items.
+        """
+        return import_mapped_data(url, self.map_spine_data(specification_path))
+
+    def create_datapackage(self, folderpath="definitions/", format="csv", schemas=None):
+        """
+        Create a DataPackage for the exported files.
+
+        The resource schemas are built from the in-memory tables, see `datapackage.create_package`.
 
         Parameters
         ----------
         folderpath : str
             the folder path of the DataPackage contents.
+        format : str
+            the file format of the exported contents, 'csv' by default.
+        schemas : dict
+            previously built Table Schemas of the tables, `None` builds them from the tables.
 
         Returns
         -------
         pkg
             a Package object with contents and metadata.
         """
-        pkg = Package(folderpath + "*.csv")
-        pkg.infer()
+        if schemas is None:
+            schemas = {
+                table: table_schema(self.get_table(table)) for table in self.tables
+            }
+        pkg = create_package(schemas, folderpath, format=format)
         pkg.name = "ambience2abm_definitions"
         pkg.licenses = [
             {
@@ -0,0 +1,141 @@
+# reader.py
+
+# Column-projected reading of the AmBIENCe deliverables.
+
+import pandas as pd
+
+# Raw AmBIENCe columns identifying and describing the reference buildings.
+REFERENCE_BUILDING_COLUMNS = [
+    "REFERENCE BUILDING CODE",
+    "REFERENCE BUILDING USE CODE",
+    "REFERENCE BUILDING COUNTRY CODE",
+    "NUMBER OF REFERENCE BUILDINGS IN THE BUILDING STOCK SEGMENT",
+    "REFERENCE BUILDING USEFUL FLOOR AREA (m2)",
+    "REFERENCE BUILDING CONSTRUCTION YEAR LOW",
+    "REFERENCE BUILDING CONSTRUCTION YEAR HIGH",
+]
+
+# Raw AmBIENCe window columns used for the fenestration statistics.
+WINDOW_COLUMNS = [
+    "REFERENCE BUILDING WINDOW GLAZING TYPE",
+    "REFERENCE BUILDING WINDOW COATED",
+    "REFERENCE BUILDING WINDOW U-VALUE (W/m2/K)",
+]
+
+# Raw AmBIENCe geometry columns used for the archetype building definitions, and their renamed versions.
+GEOMETRY_COLUMNS = {
+    "NUMBER OF REFERENCE BUILDING STOREYS": "number_of_storeys",
+    "REFERENCE BUILDING GROUND FLOOR AREA (m2)": "reference_floor_area_m2",
+    "REFERENCE BUILDING WALL AREA (m2)": "reference_wall_area_m2",
+    "REFERENCE BUILDING WINDOW AREA (m2)": "reference_window_area_m2",
+    "REFERENCE BUILDING ROOF AREA (m2)": "reference_roof_area_m2",
+}
+
+# Raw AmBIENCe heating system columns.
+HEATING_SYSTEM_COLUMNS = ["Building typology"] + [
+    f"HEATING SYSTEM {i} {prop}"
+    for i in (1, 2, 3)
+    for prop in ("PREVALENCY ON BUILDING STOCK", "FUEL USED", "DIMENSIONS")
+]
+
+# Raw AmBIENCe structure property columns, preceded by `REFERENCE BUILDING <mapping>`.
+STRUCTURE_PROPERTIES = [
+    "MATERIAL THICKNESS (m)",
+    "MATERIAL DENSITY (kg/m3)",
+    "MATERIAL SPECIFIC HEAT CAPACITY (J/kg/K)",
+    "MATERIAL THERMAL CONDUCTIVITY (W/m/K)",
+    "INSULATION MATERIAL THICKNESS (m)",
+    "INSULATION MATERIAL DENSITY (kg/m3)",
+    "INSULATION MATERIAL SPECIFIC HEAT CAPACITY (J/kg/K)",
+    "INSULATION MATERIAL THERMAL CONDUCTIVITY (W/m/K)",
+    "U-VALUE (W/m2/K)",
+]
+
+
+def required_columns(structure_mappings):
+    """
+    Derive the raw AmBIENCe columns required for processing.
+
+    Parameters
+    ----------
+    structure_mappings : iterable
+        the AmBIENCe structure names the ABM structure types are mapped to, e.g. 'WALL'.
+
+    Returns
+    -------
+    cols : list
+        the required raw AmBIENCe column names.
+    """
+    return (
+        REFERENCE_BUILDING_COLUMNS
+        + WINDOW_COLUMNS
+        + list(GEOMETRY_COLUMNS.keys())
+        + HEATING_SYSTEM_COLUMNS
+        + [
+            " ".join(["REFERENCE BUILDING", mapping, prop])
+            for mapping in dict.fromkeys(structure_mappings)
+            for prop in STRUCTURE_PROPERTIES
+        ]
+    )
+
+
+def read_ambience_workbooks(
+    building_stock_properties_path,
+    building_stock_heatsys_path,
+    heatsys_skiprows=[0],
+    columns=None,
+    engine=None,
+    countries=None,
+):
+    """
+    Read and merge the AmBIENCe deliverables, optionally only loading the given columns and countries.
+
+    Parameters
+    ----------
+    building_stock_properties_path : str
+        path to the 'AmBIENCe_Deliverable-4.1_Database-of-greybox-model-parameter-values.xlsx' raw data file.
+    building_stock_heatsys_path : str
+        path to the 'AmBIENCe-WP4-T4.2-Buildings_Energy_systems_Database_EU271.xlsx' raw data file.
+    heatsys_skiprows : array
+        row indices to skip when reading AmBIENCe heating system data.
+    columns : list
+        the raw columns to load from either workbook, `None` loads all columns.
+    engine : str
+        the `pandas.read_excel` engine, e.g. 'openpyxl' or 'calamine', `None` uses the pandas default.
+    countries : iterable
+        the country codes of the reference buildings to keep, `None` keeps all countries.
+        The workbooks are filtered right after reading, before merging them.
+
+    Returns
+    -------
+    data
+        a DataFrame containing the merged AmBIENCe data.
+    """
+    usecols = None if columns is None else set(columns).__contains__
+    properties = pd.read_excel(
+        building_stock_properties_path, usecols=usecols, engine=engine
+    )
+    heatsys = pd.read_excel(
+        building_stock_heatsys_path,
+        skiprows=heatsys_skiprows,
+        usecols=usecols,
+        engine=engine,
+    )  # Skip first row of header, later headers will be omitted through inner join.
+    if countries is not None:
+        properties = properties[
+            properties["REFERENCE BUILDING COUNTRY CODE"].isin(countries)
+        ]
+        heatsys = heatsys[
+            heatsys["Building typology"].isin(properties["REFERENCE BUILDING CODE"])
+        ]
+    data = pd.merge(  # Merge the data together to make it easier to deal with.
+        properties,
+        heatsys,
+        left_on="REFERENCE BUILDING CODE",
+        right_on="Building typology",
+    )
+    if columns is not None:
+        missing = [col for col in columns if col not in data.columns]
+        if missing:
+            raise ValueError(f"Required columns missing from AmBIENCe data: {missing}")
+    return data
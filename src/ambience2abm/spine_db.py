@@ -0,0 +1,122 @@
+# spine_db.py
+
+# Direct import of the processed tables into a Spine database.
+
+import json
+from .identifiers import materialize_labels
+
+
+def table_rows(df, sort=True):
+    """
+    Convert a table into header and rows like the Spine Toolbox Data Package connector reads them.
+
+    Parameters
+    ----------
+    df : DataFrame
+        the table to convert.
+    sort : bool
+        Flag to sort the table by its index, like when exporting it.
+
+    Returns
+    -------
+    rows : list
+        the table rows including the index, with missing values as `None`.
+    header : list
+        the column names including the index.
+    """
+    df = materialize_labels(df)
+    if sort:
+        df = df.sort_index()
+    flat = df.reset_index().astype(object)
+    return flat.where(flat.notna(), None).values.tolist(), list(flat.columns)
+
+
+def map_tables(tables, specification_path, unsorted_tables=()):
+    """
+    Map tables into Spine database items according to a Spine Toolbox importer specification.
+
+    The tables are mapped in-memory using the `spinedb_api` mapping machinery, with the same
+    mappings and column types as when importing the exported Data Package with Spine Toolbox.
+
+    Parameters
+    ----------
+    tables : dict
+        the tables keyed by their Data Package resource names.
+    specification_path : str
+        path to the importer specification, e.g. 'import_ambience2abm_data.json'.
+    unsorted_tables : iterable
+        names of the tables mapped in their existing order instead of sorting by index.
+
+    Returns
+    -------
+    mapped_data : dict
+        the mapped items as keyword arguments for `spinedb_api.import_data`.
+    """
+    from spinedb_api.import_mapping.generator import get_mapped_data
+    from spinedb_api.import_mapping.import_mapping_compat import (
+        parse_named_mapping_spec,
+    )
+    from spinedb_api.import_mapping.type_conversion import value_to_convert_spec
+
+    with open(specification_path) as f:
+        spec = json.load(f)["mapping"]
+    mapped_data = {}
+    errors = []
+    for table in spec["selected_tables"]:
+        names, mappings = zip(
+            *(
+                parse_named_mapping_spec(named)
+                for named in spec["table_mappings"][table]
+            )
+        )
+        rows, header = table_rows(tables[table], sort=table not in unsorted_tables)
+        column_types = spec["table_types"].get(table, {})
+        default_column_type = spec["table_default_column_type"].get(table)
+        data, table_errors = get_mapped_data(
+            rows,
+            list(mappings),
+            header,
+            table,
+            {int(col): value_to_convert_spec(t) for col, t in column_types.items()},
+            default_column_type and value_to_convert_spec(default_column_type),
+            mapping_names=list(names),
+        )
+        for key, items in data.items():
+            mapped_data.setdefault(key, []).extend(items)
+        errors += [f"{table}: {error}" for error in table_errors]
+    if errors:
+        raise ValueError(f"Unable to map tables for the Spine database: {errors}")
+    return mapped_data
+
+
+def import_mapped_data(url, *mapped_data, comment="Import AmBIENCe2ABM data"):
+    """
+    Import mapped items into a Spine database in a single transaction, creating the database if necessary.
+
+    Parameters
+    ----------
+    url : str
+        the Spine database URL, or a path to a local SQLite database file.
+    *mapped_data : dict
+        mapped items from `map_tables`.
+    comment : str
+        the commit message.
+
+    Returns
+    -------
+    count : int
+        the number of imported items.
+    """
+    from spinedb_api import DatabaseMapping, import_data
+
+    if "://" not in url:
+        url = "sqlite:///" + url
+    count = 0
+    with DatabaseMapping(url, create=True) as db_map:
+        for data in mapped_data:
+            n, errors = import_data(db_map, **data)
+            if errors:
+                raise ValueError(f"Unable to import into the Spine database: {errors}")
+            count += n
+        db_map.commit_session(comment)
+    return count
@@ -0,0 +1,157 @@
+# structure_physics.py
+
+# Array-level thermal physics of the building structures.
+
+import numpy as np
+
+
+def calculate_effective_thermal_mass_array(
+    material_thickness,
+    material_density,
+    material_specific_heat_capacity,
+    insulation_thickness,
+    insulation_density,
+    insulation_specific_heat_capacity,
+    interior_resistance,
+    is_internal,
+    period_of_variations=1209600,
+):
+    """
+    Calculate effective thermal masses according to 'EN ISO 13786:2017 Annex C.2.4 effective thickness method'.
+
+    All array arguments are broadcast against each other, so e.g. (reference building × structure type)
+    material property arrays can be combined with per-structure-type parameter arrays.
+    Note that internal structures assume no insulation.
+
+    Parameters
+    ----------
+    material_thickness : array
+        thickness of the structural material in metres.
+    material_density : array
+        density of the structural material in kg/m3.
+    material_specific_heat_capacity : array
+        specific heat capacity of the structural material in J/kg/K.
+    insulation_thickness : array
+        thickness of the insulation material in metres.
+    insulation_density : array
+        density of the insulation material in kg/m3.
+    insulation_specific_heat_capacity : array
+        specific heat capacity of the insulation material in J/kg/K.
+    interior_resistance : array
+        interior surface thermal resistance of the structure in m2K/W.
+    is_internal : array
+        boolean flags for internal structures.
+    period_of_variations : float or array
+        assumed period of variations in seconds, e.g. an array broadcastable against the structure arrays
+        for calculating several periods at once.
+
+    Returns
+    -------
+    effective_thermal_mass_J_m2K : array
+        the effective thermal masses in J/m2K, with the broadcast shape of all the arguments.
+    """
+    material_shc = (
+        np.asarray(material_thickness, dtype=float)
+        * material_density
+        * material_specific_heat_capacity
+    )
+    insulation_shc = (
+        np.asarray(insulation_thickness, dtype=float)
+        * insulation_density
+        * insulation_specific_heat_capacity
+    )
+    # Internal structures assume no insulation.
+    shc = (
+        material_shc
+        + (~np.asarray(is_internal, dtype=bool)).astype(float) * 0.5 * insulation_shc
+    )
+    # Apply the period of variations according to 'EN ISO 13786:2017 Annex C.2.4 effective thickness method'
+    return np.sqrt(
+        shc**2
+        / (
+            1
+            + (2 * np.pi / np.asarray(period_of_variations, dtype=float)) ** 2
+            * shc**2
+            * np.asarray(interior_resistance, dtype=float) ** 2
+        )
+    )
+
+
+def calculate_U_value_arrays(
+    material_thickness,
+    material_thermal_conductivity,
+    insulation_thickness,
+    insulation_thermal_conductivity,
+    interior_resistance,
+    exterior_resistance,
+    is_internal,
+    is_ground,
+    interior_node_depth=0.1,
+):
+    """
+    Calculate the U-values of structures.
+
+    All array arguments are broadcast against each other, so e.g. (reference building × structure type)
+    material property arrays can be combined with per-structure-type parameter arrays.
+    Internal structures assume no insulation, ground-coupled structures are connected to the ground,
+    and all other structures are connected to the ambient air.
+    Ground-coupled heat losses based on 'Kissock. K., Simplified Model for Ground Heat Transfer from Slab-on-Grade Buildings, (c) 2013 ASHRAE'
+
+    Parameters
+    ----------
+    material_thickness : array
+        thickness of the structural material in metres.
+    material_thermal_conductivity : array
+        thermal conductivity of the structural material in W/m/K.
+    insulation_thickness : array
+        thickness of the insulation material in metres.
+    insulation_thermal_conductivity : array
+        thermal conductivity of the insulation material in W/m/K.
+    interior_resistance : array
+        interior surface thermal resistance of the structure in m2K/W.
+    exterior_resistance : array
+        exterior surface thermal resistance of the structure in m2K/W.
+    is_internal : array
+        boolean flags for internal structures.
+    is_ground : array
+        boolean flags for ground-coupled structures, ignored for internal structures.
+    interior_node_depth : float or array
+        assumed depth of the aggregated effective thermal mass within the structures, given as a fraction of the total thermal resistance from the indoor surface to the middle of the thermal insulation,
+        e.g. an array broadcastable against the structure arrays for calculating several depths at once.
+
+    Returns
+    -------
+    U_values_W_m2K : tuple
+        the exterior, ground, interior, and total U-values of the structures in W/m2K,
+        each an array with the broadcast shape of all the arguments.
+    """
+    interior_node_depth = np.asarray(interior_node_depth, dtype=float)
+    is_internal = np.asarray(is_internal, dtype=bool)
+    is_ground = np.asarray(is_ground, dtype=bool) & ~is_internal
+    material_resistance = np.asarray(material_thickness, dtype=float) / np.asarray(
+        material_thermal_conductivity, dtype=float
+    )
+    insulation_resistance = np.asarray(insulation_thickness, dtype=float) / np.asarray(
+        insulation_thermal_conductivity, dtype=float
+    )
+    # Masked branches are calculated for all structures, so ignore invalid values from unused branches.
+    with np.errstate(divide="ignore", invalid="ignore"):
+        intR = np.where(
+            is_internal,
+            interior_node_depth * 0.5 * material_resistance + interior_resistance,
+            interior_node_depth * (material_resistance + 0.5 * insulation_resistance)
+            + interior_resistance,
+        )
+        flrR = material_resistance + insulation_resistance + interior_resistance
+        grnR = 1.0 / (0.114 / (0.7044 + flrR) + 0.8768 / (2.818 + flrR)) - intR
+        extR = np.where(
+            is_internal,
+            (2 - interior_node_depth) * 0.5 * material_resistance + exterior_resistance,
+            flrR + exterior_resistance - intR,
+        )
+        return (
+            np.where(is_ground, 0.0, 1.0 / extR),
+            np.where(is_ground, 1.0 / grnR, 0.0),
+            1.0 / intR,
+            np.where(is_ground, 1.0 / (intR + grnR), 1.0 / (extR + intR)),
+        )
@@ -3,6 +3,9 @@
 # Main python program to update the datapackage.
 
 import argparse
+import os
+import time
+import pandas as pd
 import ambience2abm as amb
 
 
@@ -42,7 +45,88 @@ parser.add_argument(
     default=True,
     help="Flag to aggregate all available building periods into a single archetype.",
 )
+parser.add_argument(
+    "--excel_engine",
+    type=str,
+    default=None,
+    help="The `pandas.read_excel` engine for reading the raw AmBIENCe data, e.g. `calamine` for faster parsing if `python-calamine` is installed. The pandas default by default.",
+)
+parser.add_argument(
+    "--countries",
+    type=str,
+    nargs="+",
+    default=None,
+    help="Country codes to process, e.g. `FI SE NO`, including extrapolated countries, whose source countries are read automatically. All countries by default.",
+)
+parser.add_argument(
+    "--jobs",
+    type=int,
+    default=os.cpu_count(),
+    help="Number of worker processes for calculating the building stock, structure, and ventilation and fenestration statistics per country, each sent only the data of its country, and for splitting parameter sweeps. The number of CPUs by default, 1 calculates everything in this process.",
+)
+parser.add_argument(
+    "--format",
+    type=str,
+    default="csv",
+    choices=["csv", "parquet", "arrow"],
+    help="The export file format. `parquet` and `arrow` write typed columns with dictionary-encoded index columns, with the Arrow IPC files uncompressed for memory-mapping, along with `data_<format>.json` and `definitions_<format>.json` data package descriptors. `csv` by default.",
+)
+parser.add_argument(
+    "--streaming",
+    action="store_true",
+    help="Compute and export the building stock and statistics tables one country at a time, bounding memory use for large datasets. Reuses the statistics precomputed per country via `--jobs`. The exported files are identical, only supported for the `csv` format.",
+)
+parser.add_argument(
+    "--spine_db",
+    type=str,
+    default=None,
+    help="Path to a local SQLite Spine database, or a Spine database URL, into which the data and definitions are imported directly following `import_ambience2abm_data.json` and `import_ambience2abm_definitions.json`. Created if it doesn't exist. Not used by default.",
+)
+parser.add_argument(
+    "--full_rebuild",
+    action="store_true",
+    help="Recompute and rewrite all tables and data package descriptors, ignoring the build manifest. By default, only tables with changed inputs are updated.",
+)
+parser.add_argument(
+    "--watch",
+    action="store_true",
+    help="After updating, keep the processed AmBIENCe data in memory and watch the input files, re-exporting only the affected tables whenever they change. Stop with Ctrl+C.",
+)
+parser.add_argument(
+    "--sweep_ind",
+    type=float,
+    nargs="+",
+    default=None,
+    help="Interior node depths for a parameter sweep of the structure statistics. If either sweep argument is given, the sweep is written under `sweeps/` instead of updating the datapackages. `--ind` by default.",
+)
+parser.add_argument(
+    "--sweep_pov",
+    type=float,
+    nargs="+",
+    default=None,
+    help="Periods of variations in seconds for a parameter sweep of the structure statistics, see `--sweep_ind`. `--pov` by default.",
+)
+parser.add_argument(
+    "--monte_carlo",
+    type=int,
+    default=None,
+    help="Number of Monte Carlo samples of the uncertain ventilation and fenestration assumptions in `data_assumptions/ventilation_and_fenestration_uncertainty.csv`. If given, percentiles of the ventilation and fenestration statistics are written under `uncertainty/` instead of updating the datapackages. Not used by default.",
+)
+parser.add_argument(
+    "--seed",
+    type=int,
+    default=None,
+    help="Seed for the Monte Carlo samples, for reproducible results. Unseeded by default.",
+)
+parser.add_argument(
+    "--scenarios",
+    type=str,
+    default=None,
+    help="Path to a renovation scenario definition file, e.g. `data_assumptions/renovation_scenarios.csv`. If given, the structure and ventilation and fenestration statistics of all scenarios are written under `scenarios/` instead of updating the datapackages. Not used by default.",
+)
 args = parser.parse_args()
+if args.streaming and args.format != "csv":
+    parser.error("--streaming is only supported for the `csv` format.")
 
 
 ## Extrapolation settings
@@ -56,33 +140,302 @@ extrapolation_tag = "ext"  # `building_stock` field pre-pend for new countries.
 extrapolation_year = 2016  # `building_stock_year` of new countries.
 
 
-## Process data, export .csvs and update the datapackages.
+## Processing pipelines for the data and definitions, independent of each other.
 
-print("Processing raw data...")
-ambience = amb.AmBIENCeDataset(
-    interior_node_depth=args.ind,
-    period_of_variations=args.pov,
-)
-if args.extrapolate:
-    print("Extrapolating dataset...")
-    ambience.extrapolate(
-        mappings=extrapolation_mappings, tag=extrapolation_tag, year=extrapolation_year
+
+def descriptor_path(name, format):
+    """Form the data package descriptor path, e.g. `data.json` or `data_parquet.json`."""
+    return f"{name}.json" if format == "csv" else f"{name}_{format}.json"
+
+
+def update_data(ambience, manifest, format="csv", spine_db=False, streaming=False):
+    """Process ABM data, export changed files, update the `data` descriptor if needed, and map Spine DB items if requested."""
+    log = ["Processing ABM data..."]
+    abmdata = amb.ABMDataset(ambience)
+    mode = " one country at a time" if streaming else ""
+    log.append(f"Exporting changed data .{format}s{mode}...")
+    report, records = amb.update_package(
+        abmdata,
+        "data/",
+        descriptor_path("data", format),
+        manifest,
+        format=format,
+        streaming=streaming,
     )
-print("Processing ABM data...")
-abmdata = amb.ABMDataset(ambience)
-print("Exporting data .csvs...")
-abmdata.export_csvs()
-print("Creating `data.json`...")
-abmdata.create_datapackage().to_json("data.json")
-print("Processing ABM definitions...")
-defs = amb.ABMDefinitions(
+    log.append(report.to_string() if len(report) else "All data tables up to date.")
+    # Structure physics of streamed countries aren't summarized.
+    if f"data/structure_statistics.{format}" in records and not streaming:
+        log.append(
+            "Structure physics evaluated for {unique_evaluations} unique of {evaluations} structures (hit ratio {hit_ratio:.1%}).".format(
+                **ambience.structure_physics_stats
+            )
+        )
+    log.append(
+        f"Updated `{descriptor_path('data', format)}`."
+        if descriptor_path("data", format) in records
+        else f"`{descriptor_path('data', format)}` up to date."
+    )
+    if spine_db:
+        log.append("Mapping data for the Spine database...")
+        return log, records, abmdata.map_spine_data()
+    return log, records, None
+
+
+def update_definitions(
     ambience,
-    aggregate_building_period=args.aggregate_building_period,
-    aggregate_building_type=args.aggregate_building_type,
-)
-print("Exporting definition .csvs...")
-defs.export_csvs()
-print("Creating `definitions.json`...")
-defs.create_datapackage().to_json("definitions.json")
+    manifest,
+    aggregate_building_period,
+    aggregate_building_type,
+    format="csv",
+    spine_db=False,
+):
+    """Process ABM definitions, export changed files, update the `definitions` descriptor if needed, and map Spine DB items if requested."""
+    log = ["Processing ABM definitions..."]
+    defs = amb.ABMDefinitions(
+        ambience,
+        aggregate_building_period=aggregate_building_period,
+        aggregate_building_type=aggregate_building_type,
+    )
+    log.append(f"Exporting changed definition .{format}s...")
+    report, records = amb.update_package(
+        defs,
+        "definitions/",
+        descriptor_path("definitions", format),
+        manifest,
+        format=format,
+    )
+    log.append(
+        report.to_string() if len(report) else "All definition tables up to date."
+    )
+    log.append(
+        f"Updated `{descriptor_path('definitions', format)}`."
+        if descriptor_path("definitions", format) in records
+        else f"`{descriptor_path('definitions', format)}` up to date."
+    )
+    if spine_db:
+        log.append("Mapping definitions for the Spine database...")
+        return log, records, defs.map_spine_data()
+    return log, records, None
+
+
+## Parameter sweeps of the structure statistics.
+
+sweep_folderpath = "sweeps/"  # Folder for the parameter sweep outputs.
+
+
+def sweep(ambience):
+    """Calculate and export the structure statistics for all combinations of the swept parameters."""
+    interior_node_depths = args.sweep_ind or [args.ind]
+    periods_of_variations = args.sweep_pov or [args.pov]
+    print(
+        f"Sweeping {len(interior_node_depths)} interior node depths and {len(periods_of_variations)} periods of variations..."
+    )
+    stats = ambience.sweep_structure_statistics(
+        interior_node_depths, periods_of_variations, max_workers=args.jobs
+    )
+    os.makedirs(sweep_folderpath, exist_ok=True)
+    report = amb.export.export_tables(
+        {"structure_statistics_sweep": stats}, sweep_folderpath, format=args.format
+    )
+    print(report.to_string())
+
+
+## Monte Carlo uncertainty of the ventilation and fenestration assumptions.
+
+uncertainty_path = "data_assumptions/ventilation_and_fenestration_uncertainty.csv"  # Distributions of the uncertain parameters.
+uncertainty_percentiles = [5, 25, 50, 75, 95]  # Percentiles of the sampled statistics.
+uncertainty_folderpath = "uncertainty/"  # Folder for the Monte Carlo outputs.
+
+
+def monte_carlo(ambience):
+    """Sample and export percentiles of the ventilation and fenestration statistics."""
+    print(f"Sampling {args.monte_carlo} ventilation and fenestration assumptions...")
+    stats = ambience.sample_ventilation_and_fenestration_statistics(
+        pd.read_csv(uncertainty_path).set_index("parameter"),
+        samples=args.monte_carlo,
+        percentiles=uncertainty_percentiles,
+        seed=args.seed,
+    )
+    os.makedirs(uncertainty_folderpath, exist_ok=True)
+    report = amb.export.export_tables(
+        {"ventilation_and_fenestration_percentiles": stats},
+        uncertainty_folderpath,
+        format=args.format,
+    )
+    print(report.to_string())
+
+
+## Renovation scenarios of the structure and window properties.
 
-print("All done!")
+scenario_folderpath = "scenarios/"  # Folder for the renovation scenario outputs.
+
+
+def scenarios(ambience):
+    """Calculate and export the structure and ventilation and fenestration statistics for all renovation scenarios."""
+    modifications = pd.read_csv(args.scenarios)
+    print(
+        f"Calculating {modifications['scenario'].nunique()} renovation scenarios and the baseline..."
+    )
+    structure_statistics, ventilation_and_fenestration_statistics = (
+        ambience.calculate_scenario_statistics(modifications)
+    )
+    print(
+        "Structure physics evaluated for {unique_evaluations} unique of {evaluations} structures (hit ratio {hit_ratio:.1%}).".format(
+            **ambience.scenario_physics_stats
+        )
+    )
+    os.makedirs(scenario_folderpath, exist_ok=True)
+    report = amb.export.export_tables(
+        {
+            "structure_statistics_scenarios": structure_statistics,
+            "ventilation_and_fenestration_statistics_scenarios": ventilation_and_fenestration_statistics,
+        },
+        scenario_folderpath,
+        format=args.format,
+    )
+    print(report.to_string())
+
+
+## Watch mode for fast assumption editing loops.
+
+# Assumptions re-read in-place when watching, changes to other AmBIENCe inputs reload the whole dataset.
+reloadable_assumptions = ["structure_types", "fenestration", "ventilation"]
+watch_interval = 0.5  # Seconds between checking the input files for changes.
+
+
+def load_ambience():
+    """Read and extrapolate the AmBIENCe data according to the command line arguments."""
+    ambience = amb.AmBIENCeDataset(
+        interior_node_depth=args.ind,
+        period_of_variations=args.pov,
+        excel_engine=args.excel_engine,
+        countries=args.countries,
+        extrapolation_mappings=extrapolation_mappings if args.extrapolate else {},
+    )
+    if args.extrapolate:
+        print("Extrapolating dataset...")
+        ambience.extrapolate(
+            mappings=extrapolation_mappings,
+            tag=extrapolation_tag,
+            year=extrapolation_year,
+        )
+    return ambience
+
+
+def watch(ambience, manifest):
+    """Re-export the tables affected by changes to the input files until interrupted."""
+    paths = list(ambience.input_paths.values()) + list(
+        amb.ABMDefinitions(ambience).input_paths.values()
+    )
+    mtimes = {path: os.stat(path).st_mtime_ns for path in paths}
+    pending = set()  # Changes from failed updates are retried with the next change.
+    print(f"Watching {len(paths)} input files for changes, press Ctrl+C to stop...")
+    while True:
+        time.sleep(watch_interval)
+        # Files being replaced by an editor may be briefly missing, check them next time.
+        current = {
+            path: os.stat(path).st_mtime_ns for path in paths if os.path.exists(path)
+        }
+        changed = [path for path, mtime in current.items() if mtime != mtimes[path]]
+        if not changed:
+            continue
+        mtimes |= current
+        pending |= set(changed)
+        start = time.perf_counter()
+        print(f"Changed: {', '.join(changed)}")
+        try:
+            names = {
+                name for name, path in ambience.input_paths.items() if path in pending
+            }
+            if names - set(reloadable_assumptions):
+                print("Reloading raw data...")
+                ambience = load_ambience()
+            elif names:
+                columns = amb.reader.required_columns(
+                    ambience.structure_types["mapping"]
+                )
+                ambience.read_assumptions()
+                if (
+                    amb.reader.required_columns(ambience.structure_types["mapping"])
+                    != columns
+                ):
+                    print("Structure mappings changed, reloading raw data...")
+                    ambience = load_ambience()
+            results = [
+                update_data(ambience, manifest, args.format, streaming=args.streaming),
+                update_definitions(
+                    ambience,
+                    manifest,
+                    args.aggregate_building_period,
+                    args.aggregate_building_type,
+                    args.format,
+                ),
+            ]
+        except Exception as e:  # Keep watching, e.g. if a file was saved mid-edit.
+            print(f"Update failed: {e!r}")
+            continue
+        pending.clear()
+        for log, records, _ in results:
+            print("\n".join(log))
+            manifest["outputs"] |= records
+        amb.write_manifest(manifest, amb.manifest.MANIFEST_PATH)
+        print(f"Updated in {time.perf_counter() - start:.2f} seconds.")
+
+
+## Process data, export files and update the datapackages.
+
+if __name__ == "__main__":
+    print("Processing raw data...")
+    ambience = load_ambience()
+    if args.sweep_ind is not None or args.sweep_pov is not None:
+        sweep(ambience)
+    if args.monte_carlo is not None:
+        monte_carlo(ambience)
+    if args.scenarios is not None:
+        scenarios(ambience)
+    if any(
+        arg is not None
+        for arg in [args.sweep_ind, args.sweep_pov, args.monte_carlo, args.scenarios]
+    ):
+        print("All done!")
+        raise SystemExit
+    manifest = (
+        amb.read_manifest(amb.manifest.MANIFEST_PATH)
+        if not args.full_rebuild
+        else {"outputs": {}}
+    )
+    if args.jobs > 1 and ambience.data["location_id"].nunique() > 1:
+        print(f"Calculating statistics per country on {args.jobs} workers...")
+        ambience.calculate_statistics_by_country(max_workers=args.jobs)
+    # Run in this process, sharing the memoized statistics between the pipelines.
+    results = [
+        update_data(
+            ambience, manifest, args.format, args.spine_db is not None, args.streaming
+        ),
+        update_definitions(
+            ambience,
+            manifest,
+            args.aggregate_building_period,
+            args.aggregate_building_type,
+            args.format,
+            args.spine_db is not None,
+        ),
+    ]
+    for log, _, _ in results:  # Print logs in a fixed order.
+        print("\n".join(log))
+    for _, records, _ in results:  # Record the updated outputs.
+        manifest["outputs"] |= records
+    amb.write_manifest(manifest, amb.manifest.MANIFEST_PATH)
+    if args.spine_db is not None:
+        # Imported in a single transaction here, as SQLite only allows one writer at a time.
+        print(f"Importing data and definitions into `{args.spine_db}`...")
+        count = amb.import_mapped_data(
+            args.spine_db, *(spine_data for _, _, spine_data in results)
+        )
+        print(f"Imported {count} items.")
+    print("All done!")
+    if args.watch:
+        try:
+            watch(ambience, manifest)
+        except KeyboardInterrupt:
+            print("Stopped watching.")